@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import time
+import argparse
+import datetime
+
+from mini_apps.apps.api_events.api_events import JsonStructure
+
+
+parser = argparse.ArgumentParser(description="Measures the conversion of API events with JsonStructure")
+parser.add_argument(
+    "--events", "-n",
+    type=int,
+    default=10000,
+    help="Number of events to convert"
+)
+parser.add_argument(
+    "--rounds", "-r",
+    type=int,
+    default=5,
+    help="Number of conversions of all the events, the best one is reported"
+)
+
+
+fields = {
+    "id": "str:id",
+    "title": "str:title",
+    "description": "html:details/description",
+    "image": "str:details/images/0",
+    "start": "datetime:start",
+    "finish": "datetime:end",
+    "day": "eval:self.start.date()",
+    "duration": "eval:(self.finish - self.start).total_seconds() / 60",
+}
+
+
+class InterpretedStructure(JsonStructure):
+    """
+    Walks the paths and evaluates the expressions of each field for every event
+    """
+    class Object:
+        def __init__(self, data):
+            self.data = data
+
+        def release(self):
+            self.data = None
+
+    def object(self, data):
+        obj = self.Object(data)
+        for field in self.fields:
+            if field.expression is not None:
+                value = eval(field.expression, globals(), {"self": obj})
+            else:
+                value = field.path.get(obj.data)
+                if field.conversion:
+                    value = field.conversion(value)
+            setattr(obj, field.key, value)
+        obj.release()
+        return obj
+
+
+def build_events(count):
+    start = datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone.utc)
+    events = []
+    for i in range(count):
+        event_start = start + datetime.timedelta(minutes=30 * i)
+        events.append({
+            "id": i,
+            "title": "Event %s" % i,
+            "details": {
+                "description": "<p>Description of event %s</p>" % i,
+                "images": ["https://example.com/%s.png" % i],
+            },
+            "start": event_start.isoformat(),
+            "end": (event_start + datetime.timedelta(minutes=45)).isoformat(),
+        })
+    return events
+
+
+def bench(structure, events, rounds):
+    """
+    Returns the best time per event over a few rounds
+    """
+    best = None
+    for round in range(rounds):
+        start = time.perf_counter()
+        for event in events:
+            structure.object(event)
+        elapsed = (time.perf_counter() - start) / len(events)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args):
+    events = build_events(args.events)
+    baseline = None
+    print("%-12s %12s %12s" % ("Mode", "us/event", "Speedup"))
+    for mode, cls in [("interpreted", InterpretedStructure), ("compiled", JsonStructure)]:
+        elapsed = bench(cls(fields, None), events, args.rounds)
+        if baseline is None:
+            baseline = elapsed
+        print("%-12s %12.2f %11.2fx" % (mode, elapsed * 1e6, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
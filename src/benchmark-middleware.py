@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import time
+import asyncio
+import pathlib
+import argparse
+
+import aiohttp.web
+from cryptography.fernet import Fernet
+from aiohttp.test_utils import make_mocked_request
+
+from mini_apps.http.utils import ExtendedApplication
+from mini_apps.http.middleware.base import Middleware
+from mini_apps.http.middleware.header import HeaderMiddleware
+
+
+parser = argparse.ArgumentParser(description="Measures the per-request overhead of the HTTP middleware stack")
+parser.add_argument(
+    "--requests", "-n",
+    type=int,
+    default=20000,
+    help="Number of requests per route"
+)
+parser.add_argument(
+    "--middleware", "-m",
+    type=int,
+    default=4,
+    help="Number of pass-through middleware in the stack"
+)
+
+
+class SessionLikeMiddleware(Middleware):
+    """
+    Pass-through middleware decrypting a cookie on every request, like loading an encrypted session
+    """
+    fernet = Fernet(Fernet.generate_key())
+    cookie = fernet.encrypt(b'{"session": {"csrf_token": "0123456789abcdef"}}')
+
+    async def on_process_request(self, request, handler):
+        request["mid_%s" % self.name] = self.fernet.decrypt(self.cookie)
+        return await handler(request)
+
+
+async def view(request):
+    return aiohttp.web.Response(text="view")
+
+
+def build_app(mode, middleware):
+    app = ExtendedApplication()
+    app.router.add_get("/view", view)
+    app.router.add_static("/static", pathlib.Path(__file__).parent)
+
+    if mode != "none":
+        for mid in middleware:
+            if isinstance(mid, SessionLikeMiddleware):
+                mid.skip_static = mode == "bypass"
+            app.middlewares.append(mid.process_request)
+
+    app.freeze()
+    return app
+
+
+async def bench(app, path, count, rounds=5):
+    """
+    Returns the best time per request over a few rounds
+    """
+    # Mocked requests are expensive to create so we reuse the same one
+    request = make_mocked_request("GET", path, app=app)
+    await app._handle(request)
+
+    best = None
+    for round in range(rounds):
+        start = time.perf_counter()
+        for i in range(count):
+            await app._handle(request)
+        elapsed = (time.perf_counter() - start) / count
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+async def main(args):
+    middleware = [SessionLikeMiddleware({"name": "mid%s" % i}) for i in range(args.middleware)]
+    middleware.append(HeaderMiddleware({"name": "headers", "headers": {"X_Frame_Options": "DENY", "X_Answer": 42}}))
+
+    paths = ["/view", "/static/" + pathlib.Path(__file__).name]
+    baseline = {}
+    print("%-10s %-40s %12s %12s" % ("Mode", "Path", "us/request", "Overhead"))
+    # bypass is the same stack with static files skipping the middleware
+    for mode in ["none", "full", "bypass"]:
+        app = build_app(mode, middleware)
+        for path in paths:
+            # Static files are dominated by disk access, measure the handler only
+            elapsed = await bench(app, path, args.requests if not path.startswith("/static") else args.requests // 10)
+            if mode == "none":
+                baseline[path] = elapsed
+            print("%-10s %-40s %12.2f %12.2f" % (mode, path, elapsed * 1e6, (elapsed - baseline[path]) * 1e6))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import time
+import asyncio
+import argparse
+
+import aiohttp.web
+from aiohttp.test_utils import make_mocked_request
+
+from mini_apps.http.utils import ExtendedApplication
+from mini_apps.http.routing import FlatUrlDispatcher
+
+
+parser = argparse.ArgumentParser(description="Measures route resolution time with many sub-apps")
+parser.add_argument(
+    "--requests", "-n",
+    type=int,
+    default=20000,
+    help="Number of requests per path"
+)
+parser.add_argument(
+    "--apps", "-a",
+    type=int,
+    default=12,
+    help="Number of prefixed sub-apps"
+)
+parser.add_argument(
+    "--routes", "-r",
+    type=int,
+    default=10,
+    help="Number of routes per sub-app"
+)
+
+
+async def view(request):
+    return aiohttp.web.Response(text="view")
+
+
+def build_sub_app(routes):
+    app = ExtendedApplication()
+    app.router.add_get("/", view, name="index")
+    for i in range(routes):
+        app.router.add_get("/page%s" % i, view, name="page%s" % i)
+        app.router.add_get("/item%s/{id}" % i, view, name="item%s" % i)
+    return app
+
+
+def build_app(mode, args):
+    app = ExtendedApplication(url_dispatcher=FlatUrlDispatcher() if mode == "flat" else None)
+    for i in range(args.apps):
+        app.add_named_subapp("/app%s" % i, "app%s" % i, build_sub_app(args.routes))
+
+    # Same as the auth app, which doesn't have a prefix
+    naked = ExtendedApplication()
+    naked.router.add_get("/login", view, name="login")
+    naked.router.add_get("/logout", view, name="logout")
+    app.add_named_subapp("", "auth", naked)
+
+    app.freeze()
+    return app
+
+
+async def bench(app, path, count, rounds=5):
+    """
+    Returns the best time per resolution over a few rounds
+    """
+    request = make_mocked_request("GET", path, app=app)
+    resolve = app.router.resolve
+
+    best = None
+    for round in range(rounds):
+        start = time.perf_counter()
+        for i in range(count):
+            await resolve(request)
+        elapsed = (time.perf_counter() - start) / count
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+async def main(args):
+    last = args.apps - 1
+    paths = [
+        "/app0/",
+        "/app%s/page%s" % (last, args.routes - 1),
+        "/app%s/item%s/123" % (last, args.routes - 1),
+        "/login",
+        "/app%s/missing" % last,
+        "/missing/path",
+    ]
+    baseline = {}
+    print("%-10s %-40s %12s %12s" % ("Mode", "Path", "us/request", "Speedup"))
+    for mode in ["nested", "flat"]:
+        app = build_app(mode, args)
+        for path in paths:
+            elapsed = await bench(app, path, args.requests)
+            if mode == "nested":
+                baseline[path] = elapsed
+            print("%-10s %-40s %12.2f %11.2fx" % (mode, path, elapsed * 1e6, baseline[path] / elapsed))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
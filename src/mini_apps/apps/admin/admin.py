@@ -3,6 +3,8 @@ import traceback
 
 import aiohttp
 
+from mini_apps import metrics
+from mini_apps.loop_monitor import LoopMonitor
 from mini_apps.http.middleware import messages
 from mini_apps.http.web_app import template_view, JinjaApp, view
 from mini_apps.http.route_info import RouteInfo
@@ -40,25 +42,30 @@ class AdminApp(JinjaApp):
         Registers routes to the web server
         """
         super().prepare_app(http, app)
-        app.add_static_path("/static", self.get_server_path() / "static")
+        app.add_static_path("/static", self.get_server_path() / "static", file_cache=http.file_cache)
 
     @admin_view("/", template="manage.html")
     async def manage(self, request: aiohttp.web.Request):
         bots = []
         services = []
+        loop_monitors = []
 
         for service in self.server.services.values():
             if isinstance(service.service, TelegramBot):
                 bots.append(service.service)
             else:
                 services.append(service.service)
+                if isinstance(service.service, LoopMonitor):
+                    loop_monitors.append(service.service)
 
         return self.context(
             "Services",
             services=services,
             bots=bots,
             routes=RouteInfo.from_app(self.http.app),
-            http=self.http
+            http=self.http,
+            metrics=metrics.registry.summary() if metrics.registry.enabled else None,
+            loop_monitors=loop_monitors,
         )
 
     def get_bot(self, name: str) -> TelegramBot:
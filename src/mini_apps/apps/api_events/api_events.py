@@ -1,53 +1,32 @@
+import re
 import json
+import hashlib
 import inspect
+import keyword
 import datetime
 import mimetypes
 
 import aiohttp
 import asyncio
+try:
+    import ijson
+except ImportError:
+    ijson = None
 from yarl import URL
 from markupsafe import Markup
+from telethon.tl.custom import InlineBuilder
 
 from mini_apps.telegram.bot import TelegramMiniApp
 from mini_apps.telegram.command import admin_command, bot_command
-from mini_apps.service import BaseService, ServiceStatus
+from mini_apps.polling import PollingService
 from mini_apps.http.web_app import template_view, format_minutes
 from mini_apps.telegram.events import InlineQueryEvent, NewMessageEvent
+from mini_apps.telegram.utils import InlineHandler
 from mini_apps.telegram import tl
+from mini_apps.search import SearchIndex, plain_text
+from mini_apps.intervals import IntervalIndex
 from mini_apps.markdown.html_to_markdown import html_to_markdown
-
-
-class PollingService(BaseService):
-    def __init__(self, settings, callback, delay_seconds):
-        super().__init__(settings)
-        self.callback = callback
-        self.delay_seconds = delay_seconds
-        self.sleep_task = None
-
-    async def run(self):
-        self.status = ServiceStatus.Starting
-
-        try:
-            self.keep_running = True
-            loop = asyncio.get_running_loop()
-            self.poll_future = loop.create_future()
-            self.status = ServiceStatus.Running
-            while self.keep_running:
-                task = asyncio.shield(self.poll_future)
-                await self.callback()
-                try:
-                    await asyncio.wait_for(task, self.delay_seconds)
-                except TimeoutError:
-                    pass
-            self.status = ServiceStatus.Disconnected
-        except Exception:
-            self.status = ServiceStatus.Crashed
-            self.log_exception()
-
-    async def stop(self):
-        self.keep_running = False
-        if self.poll_future and not self.poll_future.cancelled():
-            self.poll_future.cancel()
+from mini_apps.markdown.converter import MarkdownConverter
 
 
 class JsonPath:
@@ -63,55 +42,103 @@ class JsonPath:
 
         return obj
 
+    @staticmethod
+    def index(obj, chunk: str, index: int):
+        return obj[index] if isinstance(obj, list) else obj[chunk]
+
+    def source(self, obj: str):
+        """
+        Returns a Python expression that evaluates to the value at this path in obj
+        """
+        for chunk in self.chunks:
+            if chunk.isdigit():
+                obj = "_index(%s, %r, %s)" % (obj, chunk, int(chunk))
+            else:
+                obj = "%s[%r]" % (obj, chunk)
+        return obj
+
+
+class RecordingReader:
+    """
+    Reads from a stream keeping the data that has been read, until stop() is called
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+
+    async def read(self, size=-1):
+        data = await self.stream.read(size)
+        if self.chunks is not None:
+            self.chunks.append(data)
+        return data
+
+    def stop(self):
+        self.chunks = None
+
+    def data(self):
+        return b"".join(self.chunks)
+
+
+markdown_converter = None
+list_block_re = re.compile(r"(\n(?:\s*[-*] [^\n]*\n)+)")
+
 
 def markdown(text):
-    import re
-    import markdown
-    from mini_apps.markdown.autolink import AutoLinkExtension
+    global markdown_converter
+    if markdown_converter is None:
+        from mini_apps.markdown.autolink import AutoLinkExtension
+        markdown_converter = MarkdownConverter([AutoLinkExtension()])
 
-    return Markup(markdown.markdown(
-        # force blocks for ul lists
-        re.sub(r"(\n(?:\s*[-*] [^\n]*\n)+)", r"\n\1", text),
-        extensions=[AutoLinkExtension()],
-    ))
+    # force blocks for ul lists
+    return Markup(markdown_converter.convert(list_block_re.sub(r"\n\1", text)))
 
 
 class JsonStructure:
     class Object:
+        # Replaced by the field names in the class generated for each structure
+        __slots__ = ("data",)
+        fields = ()
+
         def __init__(self, data):
             self.data = data
 
         def get(self, path: str):
-            return JsonPath(str).get(self.data)
+            return JsonPath(path).get(self.data)
 
         def __json__(self):
-            data = dict(vars(self))
-            data.pop("data")
-            return data
+            return {key: getattr(self, key) for key in self.fields}
+
+        def release(self):
+            """
+            Drops the raw data once all the fields have been converted
+            """
+            self.data = None
 
     class Field:
         def __init__(self, structure, key: str, url: URL):
             self.key = key
             if url.scheme == "eval":
-                expr = url.path
-
-                def conv(obj):
-                    return eval(expr, globals(), {"self": obj})
-
-                self.conversion = conv
+                self.expression = url.path
+                self.conversion = None
                 self.path = None
             else:
+                self.expression = None
                 self.conversion = structure.conversions.get(url.scheme)
                 self.path = JsonPath(url.path)
 
-        def apply(self, obj):
-            if self.path is None:
-                val = self.conversion(obj)
+        def source(self, conversion_name: str):
+            """
+            Returns the Python statement that assigns this field on `self`, with the raw data in `data`
+            """
+            if self.expression is not None:
+                value = "(%s)" % self.expression
             else:
-                val = self.path.get(obj.data)
+                value = self.path.source("data")
                 if self.conversion:
-                    val = self.conversion(val)
-            setattr(obj, self.key, val)
+                    value = "%s(%s)" % (conversion_name, value)
+            if self.key.isidentifier() and not keyword.iskeyword(self.key):
+                return "self.%s = %s" % (self.key, value)
+            return "setattr(self, %r, %s)" % (self.key, value)
 
     def __init__(self, data, datetime_format):
         self.datetime_format = datetime_format
@@ -128,28 +155,121 @@ class JsonStructure:
         for k, v in data.items():
             self.fields.append(self.Field(self, k, URL(v)))
 
+        slots = [field.key for field in self.fields if field.key.isidentifier() and field.key != "data"]
+        # Names that can't be slots are stored in a dict
+        if len(slots) < len(self.fields) - ("data" in data):
+            slots.append("__dict__")
+        self.object_class = type("Object", (self.Object,), {
+            "__slots__": tuple(slots),
+            "fields": tuple(field.key for field in self.fields),
+        })
+        self.convert = self.compile()
+
+    def compile(self):
+        """
+        Generates a function converting raw data into an object, so the paths
+        and expressions of the fields are only parsed once
+        """
+        namespace = dict(globals())
+        namespace["_Object"] = self.object_class
+        namespace["_index"] = JsonPath.index
+
+        lines = [
+            "def convert(data):",
+            "    self = _Object(data)",
+        ]
+        for index, field in enumerate(self.fields):
+            conversion_name = "_conversion_%s" % index
+            namespace[conversion_name] = field.conversion
+            lines.append("    " + field.source(conversion_name))
+        lines.append("    return self")
+
+        exec(compile("\n".join(lines), "<JsonStructure>", "exec"), namespace)
+        return namespace["convert"]
+
     def datetime(self, val):
         if not self.datetime_format:
             return datetime.datetime.fromisoformat(val)
         return datetime.datetime.strptime(val, self.datetime_format)
 
     def object(self, data):
-        obj = self.Object(data)
-        for field in self.fields:
-            field.apply(obj)
+        obj = self.convert(data)
+        obj.release()
         return obj
 
 
+class EventSnapshot:
+    """
+    Events and the data derived from them
+
+    A new snapshot is built in full after each poll and replaces the previous
+    one at once, so readers never see partially updated data
+
+    :param base: Snapshot the events have been compared against
+    :param changed: Ids of the events added, modified or removed since base
+    """
+    def __init__(self, events=None, digests=None, base=None, changed=()):
+        self.events = events or {}
+        # Events by digest of their API data, to skip converting unchanged events
+        self.digests = digests or {}
+        self.base = base
+        self.changed = set(changed)
+        # ETag and Last-Modified of the response the events come from
+        self.validators = (None, None)
+        self.schedule = IntervalIndex([])
+        self.days = []
+        self.search_index = SearchIndex({"title": 3})
+        # Rendered event.md by (event id, ongoing)
+        self.texts = {}
+        # Inline results by (event id, ongoing)
+        self.inline_articles = {}
+
+    @property
+    def sorted_events(self):
+        return self.schedule.items
+
+    def build(self):
+        """
+        Builds the derived data, reusing what hasn't changed from base
+        """
+        self.schedule = IntervalIndex(self.events.values())
+
+        self.days = []
+        day = None
+        for event in self.sorted_events:
+            if event.day != day:
+                day = event.day
+                self.days.append({"day": day, "events": []})
+            self.days[-1]["events"].append(event)
+
+        if self.base:
+            self.search_index = self.base.search_index.copy()
+            self.texts = {key: text for key, text in self.base.texts.items() if key[0] not in self.changed}
+            self.inline_articles = {key: article for key, article in self.base.inline_articles.items() if key[0] not in self.changed}
+            self.base = None
+
+        for id in self.changed:
+            event = self.events.get(id)
+            if event is None:
+                self.search_index.remove(id)
+            else:
+                self.search_index.add(id, (event.start, str(id)), title=event.title, description=plain_text(event.description))
+
+
 class ApiEventApp(TelegramMiniApp):
     def __init__(self, settings):
         super().__init__(settings)
         self.api_url = self.settings["api-url"]
         poll_frequency = int(self.settings.get("poll", 20)) * 60
-        self.poller = PollingService(settings, self.load_commands, poll_frequency)
-        self.data = None
-        self.events = {}
-        self.sorted_events = []
-        self.days = []
+        self.poller = PollingService(
+            settings, self.load_commands, poll_frequency, self.warm_up,
+            timeout=self.settings.get("poll-timeout", None)
+        )
+        self.session = None
+        # Validators of the last response, for conditional requests
+        self.etag = None
+        self.last_modified = None
+        self.publish(EventSnapshot())
         self.path_events = JsonPath(self.settings["path-events"])
         self.event_structure = JsonStructure(
             self.settings["event-data"],
@@ -167,55 +287,194 @@ class ApiEventApp(TelegramMiniApp):
             self.poller.stop(),
             super().stop()
         )
+        if self.session:
+            await self.session.close()
+            self.session = None
 
     async def load_commands(self):
-        async with aiohttp.client.ClientSession() as session:
-            response = await session.get(self.api_url, headers={"User-Agent": "MiniApps %s" % self.name})
+        """
+        Polls the API
+
+        :return: The new snapshot, None if the events haven't changed
+        """
+        if self.session is None:
+            self.session = aiohttp.client.ClientSession(headers={"User-Agent": "MiniApps %s" % self.name})
+
+        # Conditional request, the API replies with 304 if the feed hasn't changed
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        async with self.session.get(self.api_url, headers=headers) as response:
+            if response.status == 304:
+                self.log.debug("Events not modified")
+                return None
+
+            # Errors are left to the poller, which retries with backoff
+            response.raise_for_status()
+            snapshot = await self.update_events(self.feed_events(response))
+            validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+        if snapshot is None:
+            self.etag, self.last_modified = validators
+        else:
+            # Only used once the snapshot is published, otherwise a failed warm up
+            # would get 304s until the feed changes again
+            snapshot.validators = validators
+        return snapshot
+
+    def streaming_prefix(self):
+        """
+        Returns the ijson prefix of the events, None if they can't be streamed
+        """
+        if ijson is None or not self.settings.get("stream", True):
+            return None
+
+        prefix = []
+        for chunk in self.path_events.chunks:
+            # ijson doesn't support selecting array items and its prefixes can't
+            # tell apart keys containing dots or named "item"
+            if chunk.isdigit() or "." in chunk or chunk == "item":
+                return None
+            prefix.append(chunk)
+        return ".".join(prefix + ["item"])
+
+    async def feed_events(self, response: aiohttp.ClientResponse):
+        """
+        Yields the data of each event in the API response
+
+        With ijson available, only the events are parsed as they are downloaded,
+        otherwise the whole document is parsed at once
+        """
+        prefix = self.streaming_prefix()
+        if prefix is not None:
+            reader = RecordingReader(response.content)
+            empty = True
+            async for evdata in ijson.items(reader, prefix, use_float=True):
+                if empty:
+                    reader.stop()
+                    empty = False
+                yield evdata
+
+            if not empty:
+                return
+
+            # Either there are no events or the path doesn't match anything,
+            # parsing the whole document raises an error for the latter
+            data = reader.data()
+        else:
+            data = await response.read()
+
+        for evdata in self.path_events.get(json.loads(data)):
+            yield evdata
+
+    @staticmethod
+    def event_digest(evdata):
+        return hashlib.blake2b(json.dumps(evdata, sort_keys=True, default=str).encode("utf-8"), digest_size=16).digest()
+
+    async def update_events(self, feed):
+        """
+        Reads the events from the API data, only converting events that have changed
+
+        :return: A new snapshot if any event has changed, None otherwise
+        """
+        base = self.snapshot
+        events = {}
+        digests = {}
+        async for evdata in feed:
+            digest = self.event_digest(evdata)
+            evobj = base.digests.get(digest)
+            if evobj is None:
+                evobj = self.event_structure.object(evdata)
+            events[evobj.id] = evobj
+            digests[digest] = evobj
 
+        changed = {
+            id for id in events.keys() | base.events.keys()
+            if events.get(id) is not base.events.get(id)
+        }
+        if not changed:
+            return None
+
+        return EventSnapshot(events, digests, base, changed)
+
+    async def warm_up(self, snapshot: EventSnapshot):
+        """
+        Builds a new snapshot and fills its caches before publishing it
+        """
+        if snapshot is None:
+            return
+
+        snapshot.build()
+
+        # Rendering needs the bot username
+        if self.telegram_me:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            builder = InlineBuilder(self.telegram)
             try:
-                self.data = json.loads(await response.read())
+                for index, event in enumerate(snapshot.sorted_events):
+                    await self.inline_article(builder, event, now, snapshot)
+                    # Lets other tasks run while warming up large schedules
+                    if index % 50 == 49:
+                        await asyncio.sleep(0)
             except Exception:
-                self.data = {}
+                self.log_exception("Warm up")
 
-            self.events = {}
-            for evdata in self.path_events.get(self.data):
-                evobj = self.event_structure.object(evdata)
-                self.events[evobj.id] = evobj
+        self.publish(snapshot)
+        self.etag, self.last_modified = snapshot.validators
+        await self.on_events_changed(snapshot.changed)
 
-            self.sorted_events = sorted(self.events.values(), key=lambda e: e.start)
+    def publish(self, snapshot: EventSnapshot):
+        """
+        Makes snapshot the current one
+        """
+        self.snapshot = snapshot
+        self.events = snapshot.events
+        self.sorted_events = snapshot.sorted_events
+        self.schedule = snapshot.schedule
+        self.days = snapshot.days
+        self.search_index = snapshot.search_index
+
+    async def on_events_changed(self, changed: set):
+        """
+        Called with the ids of the events that have been added, modified or removed,
+        once the new snapshot has been published
+        """
+        self.log.debug("%s events changed", len(changed))
+        self.inline_options.clear()
+
+        if not changed:
+            return
 
-            self.days = []
-            day = None
-            for event in self.sorted_events:
-                if event.day != day:
-                    day = event.day
-                    self.days.append({"day": day, "events": []})
-                self.days[-1]["events"].append(event)
+        # Broadcast the change to all users, clients disconnecting while we send are removed from the dict
+        ids = list(changed)
+        for client in list(self.clients.values()):
+            await client.send(type="events-changed", ids=ids)
 
     @template_view("/", template="events.html")
     async def index(self, request):
         now = datetime.datetime.now(datetime.timezone.utc)
+        snapshot = self.snapshot
 
         curr_id = request.url.query.get("tgWebAppStartParam", "")
         curr_event = None
         curr_day = "ongoing"
 
         if curr_id is not None:
-            curr_event = self.events.get(curr_id, None)
+            curr_event = snapshot.events.get(curr_id, None)
         else:
-            for event in self.sorted_events:
-                if event.finish > now:
-                    curr_event = event
-                    curr_id = event.id
-                    break
+            curr_event = snapshot.schedule.first_unfinished(now)
+            if curr_event:
+                curr_id = curr_event.id
 
         if curr_event:
             curr_day = curr_event.day.isoformat()
 
         return {
-            "data": self.data,
-            "events": self.events,
-            "days": self.days,
+            "events": snapshot.events,
+            "days": snapshot.days,
             "now": now,
             "current": self.current_events(now),
             "active_day": curr_day,
@@ -223,29 +482,12 @@ class ApiEventApp(TelegramMiniApp):
         }
 
     def current_events(self, now, upcoming=0):
-        current_events = []
-        for event in self.sorted_events:
-            if event.start <= now <= event.finish:
-                current_events.append(event)
-            elif event.start > now:
-                if upcoming > 0:
-                    current_events.append(event)
-                    upcoming -= 1
-                else:
-                    break
-        return current_events
+        return self.schedule.ongoing(now) + self.schedule.upcoming(now, upcoming)
 
     def current_and_future(self, now):
-        current_events = []
-        for event in self.sorted_events:
-            if now <= event.finish:
-                current_events.append(event)
-        return current_events
+        return self.schedule.ongoing(now) + self.schedule.upcoming(now)
 
     def events_from_query(self, query: str, now):
-        # Telegram supports up to 50 inline results
-        limit = 50
-
         # Specific event from the web app
         if query.startswith("event:"):
             event_id = query.split(":")[1]
@@ -257,17 +499,10 @@ class ApiEventApp(TelegramMiniApp):
 
         # Not enough to search, show all
         if len(query) < 2:
-            return self.current_and_future(now)[:limit]
+            return self.current_and_future(now)
 
         # Text-based search
-        pattern = query.lower()
-        events = []
-        for event in self.sorted_events:
-            if pattern in event.title.lower() or pattern in (event.description or "").lower():
-                events.append(event)
-                if len(events) >= limit:
-                    break
-        return events
+        return [self.events[event_id] for event_id in self.search_index.search(query)]
 
     def thumb(self, event):
         if not event.image:
@@ -287,44 +522,67 @@ class ApiEventApp(TelegramMiniApp):
             optional=True,
         )
 
-    async def on_telegram_inline(self, query: InlineQueryEvent):
+    async def event_text(self, event, now, snapshot: EventSnapshot = None):
         """
-        Called on telegram bot inline queries
+        Returns the rendered event.md for an event, it's only rendered once per snapshot
         """
-        results = []
-        template = self.get_template("event.md")
-        now = datetime.datetime.now(datetime.timezone.utc)
-        mini_app_link = self.mini_app_link()
-
-        for event in self.events_from_query(query.text, now):
-            text = await self.render_template(template, dict(
+        snapshot = snapshot or self.snapshot
+        # The text shows whether the event has already started
+        key = (event.id, event.start < now < event.finish)
+        text = snapshot.texts.get(key)
+        if text is None:
+            text = snapshot.texts[key] = await self.render_template("event.md", dict(
                 event=event,
                 html_to_markdown=html_to_markdown,
-                mini_app_link=mini_app_link,
+                mini_app_link=self.mini_app_link(),
                 now=now
             ))
-            if event.image:
-                text = "[\u200B](%s)%s" % (event.image, text)
-
-            preview_text = inspect.cleandoc("""
-            {start}, {duration}
-            {description}
-            """).format(
-                start=event.start.strftime("%A %d %H:%M"),
-                description=html_to_markdown(event.description or ""),
-                duration=format_minutes(event.duration)
-            )
+        return text
 
-            results.append(query.builder.article(
-                title=event.title,
-                description=preview_text,
-                text=text,
-                #buttons=self.inline_buttons(),
-                thumb=self.thumb(event),
-                link_preview=True,
-            ))
+    async def inline_article(self, builder, event, now, snapshot: EventSnapshot = None):
+        """
+        Returns the inline result for an event, it's only built once per snapshot
+        """
+        snapshot = snapshot or self.snapshot
+        key = (event.id, event.start < now < event.finish)
+        article = snapshot.inline_articles.get(key)
+        if article is not None:
+            return article
+
+        text = await self.event_text(event, now, snapshot)
+        if event.image:
+            text = "[\u200B](%s)%s" % (event.image, text)
+
+        preview_text = inspect.cleandoc("""
+        {start}, {duration}
+        {description}
+        """).format(
+            start=event.start.strftime("%A %d %H:%M"),
+            description=html_to_markdown(event.description or ""),
+            duration=format_minutes(event.duration)
+        )
 
-        await query.answer(results)
+        article = await builder.article(
+            title=event.title,
+            description=preview_text,
+            text=text,
+            #buttons=self.inline_buttons(),
+            thumb=self.thumb(event),
+            link_preview=True,
+        )
+        snapshot.inline_articles[key] = article
+        return article
+
+    async def on_telegram_inline(self, query: InlineQueryEvent):
+        """
+        Called on telegram bot inline queries
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        async with InlineHandler(query) as inline:
+            # Telegram supports up to 50 inline results, more are sent as the user scrolls
+            for event in inline.paginate(self.events_from_query(query.text, now)):
+                inline.add_result(self.inline_article(query.builder, event, now))
 
     def mini_app_link(self):
         return "https://t.me/{username}/{shortname}".format(
@@ -361,7 +619,6 @@ class ApiEventApp(TelegramMiniApp):
             )
             return
 
-        template = self.get_template("event.md")
         now = datetime.datetime.now(datetime.timezone.utc)
 
         events = self.current_events(now, 3)
@@ -373,13 +630,9 @@ class ApiEventApp(TelegramMiniApp):
                 file=self.file_preview(mini_app_link)
             )
 
+        snapshot = self.snapshot
         for event in events:
-            text = await self.render_template(template, dict(
-                event=event,
-                html_to_markdown=html_to_markdown,
-                mini_app_link=mini_app_link,
-                now=now
-            ))
+            text = await self.event_text(event, now, snapshot)
 
             await self.telegram.send_message(
                 msgev.chat,
@@ -393,4 +646,4 @@ class ApiEventApp(TelegramMiniApp):
         """
         Reloads the events from the API
         """
-        await self.load_commands()
+        await self.poller.trigger()
@@ -3,11 +3,11 @@ import datetime
 
 
 import aiohttp
-import aiohttp_session
 from yarl import URL
 
 from mini_apps.http.web_app import JinjaApp, view, template_view
 from mini_apps.http.middleware.base import Middleware
+from mini_apps.http.session import get_session, set_value, renew_session
 from .user import User, UserFilter, clean_telegram_auth
 
 
@@ -16,6 +16,7 @@ class Auth(JinjaApp, Middleware):
     Middleware thhat handles logins and adds request.user
     """
     auth_key = "__auth"
+    skip_static = True
 
     def __init__(self, settings):
         super().__init__(settings)
@@ -27,7 +28,7 @@ class Auth(JinjaApp, Middleware):
         self.bot_username = self.settings.get("bot-username")
 
     async def get_user(self, request):
-        session = await aiohttp_session.get_session(request)
+        session = await get_session(request)
         session_user = session.get(self.auth_key)
         if session_user:
             user = User.from_json(session_user)
@@ -81,13 +82,14 @@ class Auth(JinjaApp, Middleware):
         return aiohttp.web.HTTPSeeOther(self.http.url("%s:login" % self.name).with_query(redirect=redirect))
 
     async def log_in(self, request, user):
-        session = await aiohttp_session.get_session(request)
+        session = await get_session(request)
         user = self.filter.filter_user(user)
         request.user = user
         request.auth_change = True
 
         if user:
-            session[self.auth_key] = user.to_json()
+            await renew_session(request)
+            set_value(session, self.auth_key, user.to_json())
             self.log.info("login from %s", user.to_json())
         else:
             session.pop(self.auth_key, None)
@@ -99,7 +101,7 @@ class Auth(JinjaApp, Middleware):
 
     async def on_process_context(self, request):
         return {
-            "user": request.user
+            "user": getattr(request, "user", None)
         }
 
     def add_routes(self, http):
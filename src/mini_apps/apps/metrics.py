@@ -0,0 +1,34 @@
+import hmac
+
+import aiohttp.web
+
+from mini_apps import metrics
+from mini_apps.http.web_app import WebApp, view
+
+
+class MetricsApp(WebApp):
+    """
+    Enables metrics collection and exports the metrics in the Prometheus text format
+
+    Collection is disabled unless this app is in the settings
+    """
+    def __init__(self, settings):
+        super().__init__(settings)
+        # If set, requests need a matching "Authorization: Bearer" header
+        self.token = self.settings.get("token")
+        metrics.registry.enabled = True
+
+    def is_authorized(self, request: aiohttp.web.Request):
+        if not self.token:
+            return True
+        return hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + self.token)
+
+    @view("/")
+    async def export(self, request: aiohttp.web.Request):
+        if not self.is_authorized(request):
+            return aiohttp.web.HTTPUnauthorized()
+
+        return aiohttp.web.Response(
+            body=metrics.registry.prometheus().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
@@ -7,4 +7,4 @@ class MiniAppsCommon(WebApp):
         return "mini_apps"
 
     def prepare_app(self, http, app):
-        app.router.add_static("/", self.get_server_path() / "public")
+        app.add_static_path("/", self.get_server_path() / "public", file_cache=http.file_cache)
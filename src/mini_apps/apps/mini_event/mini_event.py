@@ -1,10 +1,10 @@
 import base64
+import asyncio
 import bisect
 import datetime
 import inspect
 import mimetypes
 import pathlib
-import time
 
 import aiocron
 import peewee
@@ -12,10 +12,11 @@ import peewee
 from mini_apps.apps.auth.user import User
 from mini_apps.telegram.bot import TelegramMiniApp, bot_command
 from mini_apps.telegram.events import NewMessageEvent, InlineQueryEvent
-from mini_apps.telegram.utils import InlineKeyboard
+from mini_apps.telegram.utils import InlineKeyboard, InlineHandler
 from mini_apps.telegram import tl
 from mini_apps.db import BaseModel, ServiceWithModels
 from mini_apps.service import Client
+from mini_apps.search import SearchIndex
 from mini_apps.http.web_app import ExtendedApplication, template_view
 
 
@@ -62,6 +63,9 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
         super().__init__(*args)
         self.events = {}
         self.sorted_events = []
+        # Inline results by event id, rebuilt when the events are loaded
+        self.inline_articles = {}
+        self.search_index = SearchIndex({"title": 3})
         self.media_url = self.settings["media-url"]
 
     def database_models(self):
@@ -81,7 +85,7 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
         Registers routes to the web server
         """
         super().prepare_app(http, app)
-        app.add_static_path("/mini_event.js", self.get_server_path() / "mini_event.js")
+        app.add_static_path("/mini_event.js", self.get_server_path() / "mini_event.js", file_cache=http.file_cache)
 
     def on_provider_start(self, provider):
         """
@@ -103,6 +107,15 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
             self.events[event.id] = event
 
         self.sorted_events = sorted(self.events.values())
+        self.inline_articles = {}
+        self.inline_options.clear()
+
+        self.search_index.clear()
+        for event in self.sorted_events:
+            self.index_event(event)
+
+    def index_event(self, event: Event):
+        self.search_index.add(event.id, (event.start, event.id), title=event.title, description=event.description)
 
     async def on_client_authenticated(self, client: Client):
         """
@@ -178,8 +191,12 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
 
             event.save()
 
+            # Ids of deleted events can be reused
+            self.inline_articles.pop(event.id, None)
             self.events[event.id] = event
             bisect.insort(self.sorted_events, event)
+            self.index_event(event)
+            self.inline_options.clear()
 
             await self.broadcast_event_change(event)
 
@@ -211,6 +228,9 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
             self.sorted_events.pop(self.sorted_events.index(ev))
         except ValueError:
             pass
+        self.search_index.remove(event_id)
+        self.inline_articles.pop(event_id, None)
+        self.inline_options.clear()
 
         # Broadcast the change to all users
         for client in self.clients.values():
@@ -296,78 +316,80 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
         kb.add_button_webview("View Events", self.url)
         return kb.to_data()
 
+    async def inline_article(self, builder, event):
+        """
+        Returns the inline result for an event, it's only built once until the events are reloaded
+        """
+        article = self.inline_articles.get(event.id)
+        if article is not None:
+            return article
+
+        image_url = self.media_url + event.image
+
+        text = inspect.cleandoc("""
+        **{event.title}**[\u200B]({image_url})
+        {event.description}
+
+        **Starts at** {event.start}
+        **Duration** {event.duration:g} hours
+
+        [View Events](https://t.me/{me}/{shortname}?startapp={event.id})
+        """).format(
+            event=event,
+            me=self.telegram_me.username,
+            shortname=self.settings["short-name"],
+            image_url=image_url
+        )
+
+        preview_text = inspect.cleandoc("""
+        {event.description}
+        Starts at {event.start}. Duration: {event.duration:g} hours
+        """).format(
+            event=event
+        )
+
+        article = await builder.article(
+            title=event.title,
+            description=preview_text,
+            text=text,
+            #buttons=self.inline_buttons(),
+            thumb=tl.types.InputWebDocument(
+                image_url,
+                size=0,
+                mime_type=mimetypes.guess_type(event.image)[0],
+                attributes=[]
+            ),
+            link_preview=True,
+        )
+        self.inline_articles[event.id] = article
+        return article
+
     async def on_telegram_inline(self, query: InlineQueryEvent):
         """
         Called on telegram bot inline queries
         """
         events = []
-        # Telegram supports up to 50 inline results
-        limit = 50
 
         # Specific event from the web app
         if query.text.startswith("event:"):
             try:
                 event_id = int(query.text.split(":")[1])
-                event = Event.get_or_none(id=event_id)
+                event = self.events.get(event_id)
                 if event:
                     events = [event]
             except Exception:
                 return
         # Not enough to search, show all
         elif len(query.text) < 2:
-            events = self.sorted_events[:limit]
+            events = self.sorted_events
         # Text-based search
         else:
-            pattern = query.text.lower()
-
-            for i in range(min(limit, len(self.sorted_events))):
-                event = self.sorted_events[i]
-                if pattern in event.title.lower() or pattern in event.description.lower():
-                    events.append(event)
-
-        # Format and return the results
-        results = []
-
-        for event in events:
-            image_url = self.media_url + event.image
-
-            text = inspect.cleandoc("""
-            **{event.title}**[\u200B]({image_url})
-            {event.description}
-
-            **Starts at** {event.start}
-            **Duration** {event.duration:g} hours
-
-            [View Events](https://t.me/{me}/{shortname}?startapp={event.id})
-            """).format(
-                event=event,
-                me=self.telegram_me.username,
-                shortname=self.settings["short-name"],
-                image_url=image_url
-            )
-
-            preview_text = inspect.cleandoc("""
-            {event.description}
-            Starts at {event.start}. Duration: {event.duration:g} hours
-            """).format(
-                event=event
-            )
-
-            results.append(query.builder.article(
-                title=event.title,
-                description=preview_text,
-                text=text,
-                #buttons=self.inline_buttons(),
-                thumb=tl.types.InputWebDocument(
-                    image_url,
-                    size=0,
-                    mime_type=mimetypes.guess_type(event.image)[0],
-                    attributes=[]
-                ),
-                link_preview=True,
-            ))
-
-        await query.answer(results)
+            events = [self.events[event_id] for event_id in self.search_index.search(query.text)]
+
+        async with InlineHandler(query) as inline:
+            # Telegram supports up to 50 inline results, more are sent as the user scrolls
+            for event in inline.paginate(events):
+                inline.add_result(self.inline_article(query.builder, event))
 
     async def check_starting(self):
         """
@@ -389,7 +411,7 @@ class MiniEventApp(TelegramMiniApp, ServiceWithModels):
                         message_count += 1
                         if message_count >= 30:
                             message_count = 0
-                            time.sleep(1)
+                            await asyncio.sleep(1)
 
                         await self.telegram.send_message(
                             user.telegram_id,
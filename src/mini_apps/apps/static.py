@@ -7,4 +7,4 @@ class StaticFiles(WebApp):
         self.path = settings.paths.root / settings["path"]
 
     def prepare_app(self, http, app):
-        app.router.add_static("/", self.path)
+        app.add_static_path("/", self.path, file_cache=http.file_cache)
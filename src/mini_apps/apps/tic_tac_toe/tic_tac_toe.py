@@ -1,27 +1,37 @@
+import asyncio
 import inspect
 import random
 
 import hashids
+import peewee
 
 from mini_apps.telegram.bot import TelegramMiniApp, bot_command
 from mini_apps.telegram.utils import InlineKeyboard
 from mini_apps.telegram.events import NewMessageEvent, InlineQueryEvent
 from mini_apps.http.web_app import ExtendedApplication, template_view
 from mini_apps.service import Client
+from mini_apps.cache import TimingWheel
+from mini_apps.db import BaseModel, JSONField, ServiceWithModels
+from mini_apps.apps.auth.user import User
+from mini_apps import metrics
 
 
 id_encoder = hashids.Hashids("tictactoe", alphabet="abcdefhkmnpqrstuvwxy34578")
+live_players = metrics.gauge("tic_tac_toe_players", "Players in memory", ["app", "online"])
+live_games = metrics.gauge("tic_tac_toe_games", "Games in progress", ["app"])
 
 
 class Player:
     """
     Keeps track of a player's status
     """
-    def __init__(self, client: Client):
+    __slots__ = ("game", "user", "client", "id", "requested", "player_order")
+
+    def __init__(self, user: User, client: Client = None):
         self.game = None
-        self.user = client.user
+        self.user = user
         self.client = client
-        self.id = client.user.telegram_id
+        self.id = user.telegram_id
         self.requested = None
         self.player_order = -1
 
@@ -34,25 +44,39 @@ class Player:
             await self.client.send(**kwargs)
 
 
-class Game:
-    triplets = [
-        (0, 1, 2),
-        (3, 4, 5),
-        (6, 7, 8),
+# Lines of cells that win the game
+triplets = [
+    (0, 1, 2),
+    (3, 4, 5),
+    (6, 7, 8),
+
+    (0, 3, 6),
+    (1, 4, 7),
+    (2, 5, 8),
 
-        (0, 3, 6),
-        (1, 4, 7),
-        (2, 5, 8),
+    (0, 4, 8),
+    (2, 4, 6),
+]
+# Bitmask of each triplet
+win_masks = [sum(1 << cell for cell in triplet) for triplet in triplets]
+# Win masks through each cell, a move can only complete these
+cell_win_masks = [[mask for mask in win_masks if mask & (1 << cell)] for cell in range(9)]
+
+
+class Game:
+    """
+    Game between two players
 
-        (0, 4, 8),
-        (2, 4, 6),
-    ]
+    The board is stored as a bitmask of the cells taken by each player
+    """
+    __slots__ = ("host", "guest", "requests", "boards", "winner", "id", "turn", "winning_cells", "free")
 
     def __init__(self, host: Player):
         self.host: Player = host
         self.guest: Player = None
         self.requests = {}
-        self.table = [""] * 9
+        # Cells taken by X and O
+        self.boards = [0, 0]
         self.winner = None
         self.id = id_encoder.encode(host.user.telegram_id)
         self.turn = -1
@@ -75,11 +99,22 @@ class Game:
         """
         return player.id == self.host.id
 
-    async def send_state(self, player: Player):
+    @property
+    def table(self):
         """
-        Sends the game state to a player
+        List of the symbols in each cell, empty strings for free cells
+        """
+        x, o = self.boards
+        return [
+            "X" if x >> cell & 1 else "O" if o >> cell & 1 else ""
+            for cell in range(9)
+        ]
+
+    def serialize_state(self):
         """
-        await player.send(
+        Returns the game state in the format expected by the client
+        """
+        return dict(
             type="game.state",
             turn=self.turn,
             table=self.table,
@@ -89,6 +124,24 @@ class Game:
             triplet=self.winning_cells
         )
 
+    def to_data(self):
+        """
+        Returns the state of a game in progress, to store it
+        """
+        return {
+            "host": self.host.user.to_json(),
+            "guest": self.guest.user.to_json() if self.guest else None,
+            "boards": self.boards,
+            "turn": self.turn,
+            "free": self.free,
+        }
+
+    async def send_state(self, player: Player):
+        """
+        Sends the game state to a player
+        """
+        await player.send(**self.serialize_state())
+
     async def send_queued_request(self):
         """
         Sends the next queued request
@@ -124,22 +177,27 @@ class Game:
         """
         Make a move on the player
         """
-        if self.winner is not None or player.player_order != self.turn or cell < 0 or cell >= 9 or self.table[cell] != "":
+        if self.winner is not None or player.player_order != self.turn or cell < 0 or cell >= 9:
+            return
+
+        bit = 1 << cell
+        if (self.boards[0] | self.boards[1]) & bit:
             return
 
         self.free -= 1
-        self.table[cell] = "XO"[player.player_order]
+        board = self.boards[player.player_order] | bit
+        self.boards[player.player_order] = board
         self.turn = (self.turn + 1) % 2
 
-        winners = set()
-        for triplet in self.triplets:
-            if self.check_same(triplet):
-                winners |= set(triplet)
+        winners = 0
+        for mask in cell_win_masks[cell]:
+            if board & mask == mask:
+                winners |= mask
 
         if winners:
             self.winner = player.user.name
             self.turn = player.player_order
-            self.winning_cells = list(winners)
+            self.winning_cells = [cell for cell in range(9) if winners >> cell & 1]
 
         elif self.winner is None and self.free <= 0:
             self.winner = "No one"
@@ -148,32 +206,315 @@ class Game:
         await self.send_state(self.host)
         await self.send_state(self.guest)
 
-    def check_same(self, triplet):
+
+class StoredGame(BaseModel):
+    id = peewee.CharField(primary_key=True)
+    host_id = peewee.BigIntegerField(index=True)
+    guest_id = peewee.BigIntegerField(index=True, null=True)
+    data = JSONField()
+
+
+class GameStore:
+    """
+    Keeps games that are no longer in memory
+
+    This one doesn't store anything, so unloaded games are lost
+    """
+    def save(self, game: Game):
+        pass
+
+    def delete(self, game_id: str):
+        pass
+
+    def load(self, telegram_id: int):
         """
-        Checks for wins
+        Returns the data of the stored game for the given player, if any
         """
-        a = self.table[triplet[0]]
-        if a == "":
-            return False
+        return None
 
-        b = self.table[triplet[1]]
-        if b == "" or a != b:
-            return False
+    async def run(self):
+        pass
 
-        c = self.table[triplet[2]]
-        if c == "" or c != b:
-            return False
+    def flush(self):
+        pass
 
-        return True
+    def retry(self):
+        """
+        Retries failed writes, called periodically
+        """
+        pass
 
 
-class TicTacToe(TelegramMiniApp):
+class DatabaseGameStore(GameStore):
+    """
+    Stores games in progress in the database
+
+    Writes are queued and coalesced, so consecutive moves on a game
+    result in a single write at most every `delay` seconds
+
+    :param on_error: Called when writing fails, the writes are retried with the next save or by retry()
+    """
+    def __init__(self, delay=1, on_error=None):
+        self.delay = delay
+        self.on_error = on_error
+        # Game id -> game to write or None to delete
+        self.pending = {}
+        self.wake = asyncio.Event()
+
+    def save(self, game: Game):
+        self.pending[game.id] = game
+        self.wake.set()
+
+    def delete(self, game_id: str):
+        self.pending[game_id] = None
+        self.wake.set()
+
+    def load(self, telegram_id: int):
+        query = StoredGame.select().where((StoredGame.host_id == telegram_id) | (StoredGame.guest_id == telegram_id))
+        for stored in query:
+            # Queued games are in memory, or have been deleted
+            if stored.id not in self.pending:
+                return stored.data
+        return None
+
+    def flush(self):
+        """
+        Writes the queued changes
+        """
+        pending = self.pending
+        self.pending = {}
+        try:
+            with StoredGame._meta.database.atomic():
+                for game_id, game in pending.items():
+                    if game is None:
+                        StoredGame.delete_by_id(game_id)
+                    else:
+                        StoredGame.replace(
+                            id=game_id,
+                            host_id=game.host.id,
+                            guest_id=game.guest.id if game.guest else None,
+                            data=game.to_data()
+                        ).execute()
+        except Exception:
+            # Changes queued in the meantime are more recent
+            for game_id, game in pending.items():
+                self.pending.setdefault(game_id, game)
+            if self.on_error:
+                self.on_error()
+
+    def retry(self):
+        # Pending changes are either scheduled or left over by a failed write
+        if self.pending:
+            self.wake.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self.wake.wait()
+                await asyncio.sleep(self.delay)
+                self.wake.clear()
+                self.flush()
+        finally:
+            # Writes what's left on shutdown
+            self.flush()
+
+
+class TicTacToe(TelegramMiniApp, ServiceWithModels):
     """
     Tic Tac Toe Game
     """
     def __init__(self, *args):
         super().__init__(*args)
         self.players = {}
+        self.games = {}
+        # Games are only stored in the database if `persist` is set
+        persist = self.settings.get("persist", False)
+        if persist:
+            delay = persist.get("delay", 1) if isinstance(persist, dict) else 1
+            self.store = DatabaseGameStore(delay, lambda: self.log_exception("Could not store games"))
+        else:
+            self.store = GameStore()
+        # Seconds disconnected players are kept for
+        self.player_ttl = self.settings.get("player-ttl", 3600)
+        # Seconds without moves before a game is abandoned
+        self.game_ttl = self.settings.get("game-ttl", 3600)
+        # Expiry of ("player", telegram_id) and ("game", game_id)
+        self.expiry = TimingWheel(self.settings.get("sweep-interval", 10))
+
+    def database_models(self):
+        return [StoredGame] if isinstance(self.store, DatabaseGameStore) else []
+
+    def consumes(self):
+        consumes = super().consumes()
+        # Only needed to persist games
+        if not self.database_models():
+            consumes.remove("database")
+        return consumes
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.sweep()), asyncio.create_task(self.store.run())]
+        try:
+            await super().run()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Waits for the store to write the pending games
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def sweep(self):
+        """
+        Drops expired players and games
+        """
+        while True:
+            await asyncio.sleep(self.expiry.tick)
+            for kind, key in self.expiry.advance():
+                try:
+                    if kind == "player":
+                        player = self.players.get(key)
+                        if player:
+                            await self.expire_player(player)
+                    else:
+                        game = self.games.get(key)
+                        if game:
+                            await self.expire_game(game)
+                except Exception:
+                    self.log_exception("Expiring %s %s", kind, key)
+            self.update_live_counts()
+            self.store.retry()
+
+    def live_counts(self):
+        online = sum(1 for player in self.players.values() if player.client)
+        return {
+            "players": len(self.players),
+            "online": online,
+            "games": len(self.games),
+        }
+
+    def update_live_counts(self):
+        counts = self.live_counts()
+        live_players.labels(self.name, "yes").set(counts["online"])
+        live_players.labels(self.name, "no").set(counts["players"] - counts["online"])
+        live_games.labels(self.name).set(counts["games"])
+
+    def touch_game(self, game: Game):
+        """
+        Called when a game changes, postpones its expiry and stores it
+        """
+        self.expiry.schedule(("game", game.id), self.game_ttl)
+        self.store.save(game)
+
+    def get_player(self, user: User):
+        """
+        Returns the player for a user, creating it if needed
+        """
+        player = self.players.get(user.telegram_id)
+        if not player:
+            player = self.players[user.telegram_id] = Player(user)
+            # Not connected yet
+            self.expiry.schedule(("player", player.id), self.player_ttl)
+        return player
+
+    def restore_game(self, player: Player):
+        """
+        Loads the stored game of a player back into memory
+        """
+        data = self.store.load(player.id)
+        if not data:
+            return None
+
+        host = self.get_player(User.from_json(data["host"]))
+        guest = self.get_player(User.from_json(data["guest"])) if data["guest"] else None
+        for other in (host, guest):
+            if other and other.game:
+                # Already playing something else
+                return None
+
+        game = Game(host)
+        game.guest = guest
+        game.boards = data["boards"]
+        game.turn = data["turn"]
+        game.free = data["free"]
+        host.game = game
+        host.player_order = 0
+        if guest:
+            guest.game = game
+            guest.player_order = 1
+
+        self.games[game.id] = game
+        self.expiry.schedule(("game", game.id), self.game_ttl)
+        return game
+
+    def remove_game(self, game: Game):
+        """
+        Forgets about a game that has been finished or abandoned
+        """
+        if self.games.get(game.id) is game:
+            del self.games[game.id]
+        self.expiry.cancel(("game", game.id))
+        self.store.delete(game.id)
+
+    def unload_game(self, game: Game):
+        """
+        Removes a game from memory, storing it so it can be restored later
+        """
+        self.store.save(game)
+        if self.games.get(game.id) is game:
+            del self.games[game.id]
+        self.expiry.cancel(("game", game.id))
+        for player in (game.host, game.guest):
+            if player and player.game is game:
+                player.game = None
+
+    async def leave_game(self, player: Player):
+        """
+        Removes a player from their game
+        """
+        game = player.game
+        if not game:
+            return
+
+        if game.is_host(player):
+            if game.guest:
+                game.guest.game = None
+                await game.guest.send(type="game.leave")
+            self.remove_game(game)
+        else:
+            game.guest = None
+            self.store.save(game)
+
+        player.game = None
+
+    async def expire_game(self, game: Game):
+        """
+        Ends a game nobody has played for a while
+        """
+        for player in (game.host, game.guest):
+            if player and player.game is game:
+                player.game = None
+                await player.send(type="game.leave")
+        self.remove_game(game)
+
+    async def expire_player(self, player: Player):
+        """
+        Drops a player that has been disconnected for a while
+        """
+        if player.client:
+            return
+
+        game = player.game
+        if game:
+            other = game.guest if game.is_host(player) else game.host
+            # Keep the player while their opponent is still around
+            if other and other.game is game and other.client:
+                self.expiry.schedule(("player", player.id), self.player_ttl)
+                return
+            self.unload_game(game)
+
+        requested = self.games.get(player.requested)
+        if requested:
+            requested.requests.pop(player.id, None)
+
+        del self.players[player.id]
 
     @template_view("/", template="tic_tac_toe.html")
     async def index(self, request):
@@ -186,7 +527,7 @@ class TicTacToe(TelegramMiniApp):
         Registers routes to the web server
         """
         super().prepare_app(http, app)
-        app.add_static_path("/tic_tac_toe.js", self.get_server_path() / "tic_tac_toe.js")
+        app.add_static_path("/tic_tac_toe.js", self.get_server_path() / "tic_tac_toe.js", file_cache=http.file_cache)
 
     def inline_buttons(self):
         """
@@ -202,12 +543,15 @@ class TicTacToe(TelegramMiniApp):
         """
         player: Player = self.players.get(client.user.telegram_id)
         if not player:
-            player = Player(client)
+            player = Player(client.user, client)
             self.players[client.user.telegram_id] = player
         else:
             player.client = client
 
+        self.expiry.cancel(("player", player.id))
         client.player = player
+        if not player.game:
+            self.restore_game(player)
         if player.game:
             await player.game.send_to_player(player)
         else:
@@ -273,6 +617,7 @@ class TicTacToe(TelegramMiniApp):
         """
         if client.player:
             client.player.client = None
+            self.expiry.schedule(("player", client.player.id), self.player_ttl)
             # TODO update online status for the other player (if any)
 
     async def handle_message(self, client: Client, type: str, data: dict):
@@ -287,19 +632,13 @@ class TicTacToe(TelegramMiniApp):
                 game = Game(client.player)
                 client.player.game = game
                 client.player.requested = None
+                self.games[game.id] = game
+                self.touch_game(game)
             await game.send_to_player(client.player)
 
         # A user leaves / cancels the game
         elif type == "game.leave":
-            if game:
-                if game.is_host(client.player):
-                    if game.guest:
-                        game.guest.game = None
-                        await game.guest.send(type="game.leave")
-                else:
-                    game.guest = None
-
-                client.player.game = None
+            await self.leave_game(client.player)
 
         # A user wants to join an existing game
         elif type == "game.join":
@@ -314,6 +653,7 @@ class TicTacToe(TelegramMiniApp):
             guest.game = game
             game.guest = guest
             game.turn = random.randint(0, 1)
+            self.touch_game(game)
             await game.send_to_player(client.player)
             await game.send_to_player(guest)
 
@@ -339,6 +679,9 @@ class TicTacToe(TelegramMiniApp):
                 if game.winner is not None:
                     game.guest.game = None
                     game.host.game = None
+                    self.remove_game(game)
+                else:
+                    self.touch_game(game)
 
     async def on_telegram_inline(self, query: InlineQueryEvent):
         """
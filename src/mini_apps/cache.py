@@ -0,0 +1,213 @@
+import math
+import time
+import hashlib
+import functools
+import collections
+
+
+class LruCache:
+    """
+    Mapping that keeps the most recently used items, bounded by total size and optionally by age
+
+    :param max_size: Maximum total size of the stored values (None for unbounded)
+    :param ttl: Number of seconds after which an item expires (None for no expiry)
+    :param sizeof: Callable returning the size of a value, defaults to counting items
+    """
+    def __init__(self, max_size=None, ttl=None, sizeof=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.clock = clock
+        self.total_size = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key and marks it as recently used
+        """
+        item = self._items.get(key)
+        if item is None:
+            return default
+
+        value, expires, size = item
+        if expires is not None and expires <= self.clock():
+            self.pop(key)
+            return default
+
+        self._items.move_to_end(key)
+        return value
+
+    def touch(self, key):
+        """
+        Pushes forward the expiry time of an item
+
+        :return: False if the item is missing or expired
+        """
+        if self.get(key, self) is self:
+            return False
+
+        if self.ttl is not None:
+            value, expires, size = self._items[key]
+            self._items[key] = (value, self.clock() + self.ttl, size)
+        return True
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used ones if needed
+
+        :return: False if the value is too large to be stored at all
+        """
+        self.pop(key)
+
+        size = self.sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            return False
+
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        self._items[key] = (value, expires, size)
+        self.total_size += size
+
+        while self.max_size is not None and self.total_size > self.max_size:
+            self.pop(next(iter(self._items)))
+
+        return True
+
+    def pop(self, key, default=None):
+        """
+        Removes a value from the cache
+        """
+        item = self._items.pop(key, None)
+        if item is None:
+            return default
+        self.total_size -= item[2]
+        return item[0]
+
+    def clear(self):
+        self._items.clear()
+        self.total_size = 0
+
+    def evict_expired(self):
+        """
+        Removes all expired items
+        """
+        if self.ttl is None:
+            return
+
+        now = self.clock()
+        for key, (value, expires, size) in list(self._items.items()):
+            if expires <= now:
+                self.pop(key)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, self) is self:
+            raise KeyError(key)
+
+
+def content_key(text: str):
+    """
+    Returns a short digest of text, to use large strings as keys without keeping them around
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def memoize_text(max_size=1024):
+    """
+    Decorator caching the results of a function taking a single string, by content
+    """
+    def decorator(func):
+        cache = LruCache(max_size)
+
+        @functools.wraps(func)
+        def wrapper(text):
+            key = content_key(text)
+            result = cache.get(key)
+            if result is None:
+                result = func(text)
+                cache.put(key, result)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel, schedules the expiry of many keys with O(1) updates
+
+    Keys are placed in the slot of the tick they expire on, so advancing the wheel
+    only looks at the slots for the elapsed ticks
+
+    :param tick: Resolution in seconds
+    :param slots: Number of slots, deadlines further than a full turn wait for more turns
+    """
+    def __init__(self, tick=1.0, slots=64, clock=time.monotonic):
+        self.tick = tick
+        self.slots = [set() for i in range(slots)]
+        self.clock = clock
+        self.deadlines = {}
+        self.slot_of = {}
+        self.current_tick = int(clock() / tick)
+
+    def schedule(self, key, delay: float):
+        """
+        Sets key to expire after delay seconds, replacing any previous deadline
+        """
+        self.cancel(key)
+        deadline = self.clock() + delay
+        # Never in a slot that has already been processed
+        tick = max(math.ceil(deadline / self.tick), self.current_tick + 1)
+        slot = self.slots[tick % len(self.slots)]
+        slot.add(key)
+        self.slot_of[key] = slot
+        self.deadlines[key] = deadline
+
+    def cancel(self, key):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            slot.discard(key)
+            del self.deadlines[key]
+
+    def deadline(self, key):
+        return self.deadlines.get(key)
+
+    def advance(self):
+        """
+        Removes and returns the keys that have expired
+        """
+        now = self.clock()
+        now_tick = int(now / self.tick)
+        # After a full turn all the slots have been looked at
+        ticks = min(now_tick - self.current_tick, len(self.slots))
+        self.current_tick = now_tick
+
+        expired = []
+        for tick in range(now_tick - ticks + 1, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for key in list(slot):
+                if self.deadlines[key] <= now:
+                    self.cancel(key)
+                    expired.append(key)
+        return expired
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
@@ -1,9 +1,13 @@
 import json
 import peewee
 
+from . import metrics
 from .service import BaseService, Service, ServiceProvider, ServiceStatus
 
 
+query_time = metrics.histogram("database_query_duration_seconds", "Time spent running database queries", ["operation"])
+
+
 class JSONField(peewee.TextField):
     """
     Field that stores data as JSON
@@ -24,6 +28,18 @@ class BaseModel(peewee.Model):
         database = peewee.DatabaseProxy()
 
 
+class InstrumentedDatabase:
+    """
+    Mixin for peewee databases that records query times
+    """
+    def execute_sql(self, sql, *args, **kwargs):
+        if not metrics.registry.enabled:
+            return super().execute_sql(sql, *args, **kwargs)
+
+        with metrics.timer(query_time, sql.lstrip().split(" ", 1)[0].upper()):
+            return super().execute_sql(sql, *args, **kwargs)
+
+
 def connect(database):
     """
     Updates BaseModel and returns the database connection
@@ -42,6 +58,7 @@ class Database(BaseService):
         self.database_models = []
         db_settings = dict(settings.dict())
         cls = self.settings.import_class(db_settings.pop("db_class"))
+        cls = type(cls.__name__, (InstrumentedDatabase, cls), {})
         db_settings.pop("_global")
 
         if cls.__name__ == "SqliteDatabase" and db_settings["database"] != ":memory:":
@@ -0,0 +1,202 @@
+import os
+import gzip
+import asyncio
+import hashlib
+import pathlib
+import mimetypes
+import email.utils
+
+import aiohttp.web
+
+from ..cache import LruCache
+
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def accepts_gzip(accept_encoding: str):
+    """
+    Whether an Accept-Encoding header allows gzip, taking into account q=0
+    """
+    wildcard = False
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        quality = 1
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+
+        coding = coding.strip().lower()
+        if coding == "gzip":
+            return quality > 0
+        elif coding == "*":
+            wildcard = quality > 0
+
+    return wildcard
+
+
+class CachedFile:
+    """
+    In-memory copy of a static file
+    """
+    def __init__(self, path: pathlib.Path, stat: os.stat_result, data: bytes):
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.data = data
+        self.content_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+        self.etag = 'W/"%s"' % hashlib.blake2b(data, digest_size=8).hexdigest()
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.gzip = None
+
+        if len(data) >= 256 and self.is_compressible(self.content_type):
+            compressed = gzip.compress(data, mtime=0)
+            if len(compressed) < len(data):
+                self.gzip = compressed
+
+    @staticmethod
+    def is_compressible(content_type):
+        return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+    def memory_size(self):
+        """
+        Number of bytes held by this file
+        """
+        return len(self.data) + (len(self.gzip) if self.gzip else 0)
+
+    def is_stale(self, stat: os.stat_result):
+        return stat.st_mtime_ns != self.mtime or stat.st_size != self.size
+
+    def not_modified(self, request: aiohttp.web.Request):
+        """
+        Whether the client already has this version of the file
+        """
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(",")]
+            return "*" in etags or self.etag in etags
+
+        return request.headers.get("If-Modified-Since") == self.last_modified
+
+    def response(self, request: aiohttp.web.Request):
+        """
+        Returns the response for the cached file
+        """
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+        }
+        if self.gzip:
+            headers["Vary"] = "Accept-Encoding"
+
+        if self.not_modified(request):
+            return aiohttp.web.Response(status=304, headers=headers)
+
+        body = self.data
+        if self.gzip and accepts_gzip(request.headers.get("Accept-Encoding", "")):
+            body = self.gzip
+            headers["Content-Encoding"] = "gzip"
+
+        return aiohttp.web.Response(body=body, headers=headers, content_type=self.content_type)
+
+
+class FileCache:
+    """
+    Keeps small static files in memory
+
+    :param max_size: Maximum number of bytes to keep in memory
+    :param max_file_size: Files larger than this are always served from disk
+    :param check_mtime: If True, files are reloaded when they change on disk
+    """
+    def __init__(self, max_size=4 * 1024 * 1024, max_file_size=256 * 1024, check_mtime=True):
+        self.max_file_size = max_file_size
+        self.check_mtime = check_mtime
+        self.files = LruCache(max_size, sizeof=CachedFile.memory_size)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Creates a cache from the `static-cache` setting, returns None if caching is disabled
+        """
+        if not settings:
+            return None
+
+        if settings is True:
+            settings = {}
+
+        return cls(
+            max_size=settings.get("max-size", 4 * 1024 * 1024),
+            max_file_size=settings.get("max-file-size", 256 * 1024),
+            check_mtime=settings.get("check-mtime", True),
+        )
+
+    def lookup(self, path: pathlib.Path):
+        """
+        Returns the cached file if present and up to date
+        """
+        cached = self.files.get(path)
+        if cached is None:
+            return None
+
+        if self.check_mtime:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.files.pop(path)
+                return None
+
+            if cached.is_stale(stat):
+                self.files.pop(path)
+                return None
+
+        return cached
+
+    def _load(self, path: pathlib.Path):
+        stat = os.stat(path)
+        if stat.st_size > self.max_file_size or not pathlib.Path(path).is_file():
+            return None
+
+        with open(path, "rb") as file:
+            return CachedFile(path, stat, file.read())
+
+    async def get(self, path: pathlib.Path):
+        """
+        Returns the cached file, loading it if needed
+
+        Returns None if the file cannot be cached
+        """
+        cached = self.lookup(path)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        try:
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(None, self._load, path)
+        except OSError:
+            return None
+
+        if cached is not None:
+            self.files.put(path, cached)
+        return cached
+
+    def invalidate(self, path: pathlib.Path = None):
+        """
+        Drops a file (or all files if path is None) from the cache
+        """
+        if path is None:
+            self.files.clear()
+        else:
+            self.files.pop(path)
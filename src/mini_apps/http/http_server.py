@@ -3,13 +3,21 @@ import json
 
 import aiohttp
 import aiohttp.web
-import aiohttp_session
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
 from yarl import URL
 
+from .. import metrics
 from ..service import BaseService, ServiceStatus, Client, Service, ServiceProvider
 from .middleware.csrf import CsrfMiddleware
 from .utils import ExtendedApplication
+from .file_cache import FileCache
+from .url_map import UrlMap
+from .routing import FlatUrlDispatcher
+from .session import SessionManager, DatabaseStorage, storage_from_settings
+
+
+socket_message_count = metrics.counter("websocket_messages_total", "Websocket messages received", ["app"])
+socket_error_count = metrics.counter("websocket_errors_total", "Invalid or failed websocket messages")
+socket_message_time = metrics.histogram("websocket_message_duration_seconds", "Time spent handling websocket messages", ["app"])
 
 
 class HttpServer(BaseService):
@@ -19,11 +27,17 @@ class HttpServer(BaseService):
 
     def __init__(self, settings):
         super().__init__(settings)
-        self.app = ExtendedApplication()
+        self.app = ExtendedApplication(
+            url_dispatcher=FlatUrlDispatcher() if settings.get("routing") == "flat" else None
+        )
         self.middleware = [
             CsrfMiddleware(settings)
         ]
-        aiohttp_session.setup(self.app, EncryptedCookieStorage(settings["secret-key"]))
+        self.session_manager = SessionManager(
+            storage_from_settings(settings),
+            settings.get("server-timing", False)
+        )
+        self.session_manager.setup(self.app)
         self.host = settings.get("host", "localhost")
         self.port = settings.get("port", 2537)
         self.http_provider = ServiceProvider("http", self)
@@ -33,18 +47,38 @@ class HttpServer(BaseService):
         self.base_url = settings["url"].rstrip("/")
         self.websocket_url = self.base_url.replace("http", "ws") + self.websocket_settings
         self.common_template_paths = []
+        self.file_cache = FileCache.from_settings(settings.get("static-cache"))
+        self.url_map = None
         if self.websocket_settings:
             self.app.add_routes([aiohttp.web.get(self.websocket_settings, self.socket_handler)])
 
-    def url(self, url_name, *, app=None, **kwargs):
-        router = (app or self.app).router
-        for chunk in url_name.split(":"):
-            resource = router.named_resources()[chunk]
-            try:
-                router = resource._app.router
-            except Exception:
-                break
-        return URL(self.base_url + str(resource.url_for(**kwargs)))
+    def url_builder(self, url_name, app=None):
+        """
+        Returns the UrlBuilder for a route name
+
+        :param app: If not None, names relative to this sub-app take precedence
+        """
+        if self.url_map is None:
+            self.url_map = UrlMap(self.base_url, self.app)
+
+        try:
+            return self.url_map.builder(url_name, app)
+        except KeyError:
+            # Once the app is frozen no routes can be added, so the name doesn't exist
+            if self.app.frozen:
+                raise
+            # Before startup routes might have been added after the map was built
+            self.url_map = UrlMap(self.base_url, self.app)
+            return self.url_map.builder(url_name, app)
+
+    def url(self, url_name, *, app=None, **kwargs) -> URL:
+        return self.url_builder(url_name, app).build_url(**kwargs)
+
+    def url_string(self, url_name, *, app=None, **kwargs) -> str:
+        """
+        Same as url() but returns a string
+        """
+        return self.url_builder(url_name, app).url_string(**kwargs)
 
     def register_consumer(self, what, service: Service):
         """
@@ -58,6 +92,19 @@ class HttpServer(BaseService):
     def register_middleware(self, middleware):
         self.middleware.append(middleware)
 
+    def on_provider_added(self, provider: ServiceProvider):
+        """
+        Called when the server is added to the database provider (for database sessions)
+        """
+        if provider.name == "database":
+            provider.service.database_models += self.session_manager.storage.database_models()
+
+    def on_provider_start(self, provider: ServiceProvider):
+        pass
+
+    def on_provider_stop(self, provider: ServiceProvider):
+        pass
+
     async def run(self):
         """
         Runs the websocket server
@@ -74,6 +121,9 @@ class HttpServer(BaseService):
             self.http_provider.on_start()
             self.socket_provider.on_start()
 
+            # All sub-apps are registered at this point
+            self.url_map = UrlMap(self.base_url, self.app)
+
             runner = aiohttp.web.AppRunner(self.app)
             await runner.setup()
             self.site = aiohttp.web.TCPSite(runner, self.host, self.port)
@@ -150,7 +200,8 @@ class HttpServer(BaseService):
             async for app, message, raw in self.socket_messages(client):
                 self.log.debug("#%s %s msg %s", client.id, app.name, raw[:80])
                 type = message.get("type", "")
-                await app.handle_message(client, type, message)
+                with metrics.timer(socket_message_time, app.name):
+                    await app.handle_message(client, type, message)
 
         except Exception:
             client.app.log_exception()
@@ -182,12 +233,15 @@ class HttpServer(BaseService):
                     if app_name:
                         app = self.socket_provider.apps.get(app_name)
                         if app:
+                            socket_message_count.labels(app_name).inc()
                             yield app, data, message.data
                             continue
 
+                    socket_error_count.inc()
                     self.log.warn("#%s unknown %s", client.id, message.data[:80])
                     await client.send(type="error", msg="Missing App ID")
                 except Exception:
+                    socket_error_count.inc()
                     self.log_exception("#%s Socket Error %s", client.id, message.data[:80])
                     await client.send(type="error", msg="Internal server error")
         except (asyncio.exceptions.IncompleteReadError):
@@ -198,3 +252,9 @@ class HttpServer(BaseService):
         if self.websocket_settings:
             provides.append("websocket")
         return provides
+
+    def consumes(self):
+        consumes = super().consumes()
+        if isinstance(self.session_manager.storage, DatabaseStorage):
+            consumes.append("database")
+        return consumes
@@ -1,8 +1,21 @@
 import aiohttp.web
+from aiohttp.web_urldispatcher import StaticResource
+
 from ...service import Service, ServiceStatus
+from ..utils import FileResource
+
+
+def is_static_route(route):
+    """
+    Whether the route serves static files
+    """
+    return isinstance(getattr(route, "resource", None), (StaticResource, FileResource))
 
 
 class Middleware(Service):
+    # Whether requests for static files go straight to the handler
+    skip_static = False
+
     def __init__(self, settings):
         super().__init__(settings)
         self.http = None
@@ -28,6 +41,8 @@ class Middleware(Service):
         """
         aiohttp middleware
         """
+        if self.skip_static and is_static_route(request.match_info.route):
+            return await handler(request)
         return await self.on_process_request(request, handler)
 
     async def on_process_request(self, request: aiohttp.web.Request, handler):
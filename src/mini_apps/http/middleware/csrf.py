@@ -6,8 +6,11 @@ import uuid
 import functools
 
 import aiohttp.web
-from aiohttp_session import get_session
-from .base import Middleware
+import aiohttp_session
+from markupsafe import Markup, escape
+
+from .base import Middleware, is_static_route
+from ..session import get_session, set_value
 
 
 MIDDLEWARE_SKIP_PROPERTY = 'csrf_middleware_skip'
@@ -17,16 +20,36 @@ HEADER_NAME = FORM_FIELD_NAME = SESSION_KEY = "csrf_token"
 
 
 class Storage():
+    """
+    Keeps the CSRF token in the session
+
+    Tokens are only generated (and written to the session) when something reads them
+    """
+    def __init__(self):
+        self.session_writes = 0
+        self.avoided_writes = 0
+
     def _generate_token(self):
         return uuid.uuid4().hex
 
-    async def generate_new_token(self, request):
-        if REQUEST_NEW_TOKEN_KEY in request:
-            return request[REQUEST_NEW_TOKEN_KEY]
+    def request_token(self, request):
+        """
+        Returns the token for the current request without loading the session
 
-        token = self._generate_token()
+        The token stored in the session is reused if the session has been loaded,
+        otherwise a new token is generated and it will be persisted by save_token()
+        """
+        token = request.get(REQUEST_NEW_TOKEN_KEY)
+        if token is not None:
+            return token
+
+        session = request.get(aiohttp_session.SESSION_KEY)
+        if session is not None:
+            token = session.get(SESSION_KEY, None)
 
-        request[REQUEST_NEW_TOKEN_KEY] = token
+        if token is None:
+            token = self._generate_token()
+            request[REQUEST_NEW_TOKEN_KEY] = token
 
         return token
 
@@ -35,30 +58,59 @@ class Storage():
         return session.get(SESSION_KEY, None)
 
     async def get_token(self, request):
-        token = await self._get(request)
-
-        await self.generate_new_token(request)
-
-        return token
+        return await self._get(request)
 
     async def set_token(self, request, token):
         session = await get_session(request)
-        session[SESSION_KEY] = token
+        set_value(session, SESSION_KEY, token)
 
     async def save_token(self, request):
-        old_token = await self._get(request)
-
-        if REQUEST_NEW_TOKEN_KEY in request:
-            token = request[REQUEST_NEW_TOKEN_KEY]
-        elif old_token is None:
-            token = await self.generate_new_token(request)
-        else:
-            token = None
+        """
+        Persists tokens generated during the request
 
+        :return: The new token or None if the session has not been modified
+        """
+        token = request.get(REQUEST_NEW_TOKEN_KEY)
         if token is not None:
             await self.set_token(request, token)
+            self.session_writes += 1
+            return token
+
+        # Count the cases where we'd have loaded the session to store a token
+        session = request.get(aiohttp_session.SESSION_KEY)
+        if session is None or SESSION_KEY not in session:
+            self.avoided_writes += 1
+
+        return None
 
-        return token
+
+class LazyToken:
+    """
+    Template value that only generates the token when rendered
+    """
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def value(self):
+        return storage.request_token(self.request)
+
+    def __str__(self):
+        return self.value
+
+    def __html__(self):
+        return escape(self.value)
+
+
+class LazyTokenInput(LazyToken):
+    """
+    Hidden form input with the token, only generated when rendered
+    """
+    def __html__(self):
+        return Markup("<input type='hidden' value='%s' name='%s' />") % (self.value, FORM_FIELD_NAME)
+
+    def __str__(self):
+        return str(self.__html__())
 
 
 async def form_check(request, original_value):
@@ -89,40 +141,61 @@ async def form_or_header_check(request, original_value):
 storage = Storage()
 
 
-def csrf_protect(handler=None):
-    def wrapper(handler):
-        @functools.wraps(handler)
-        async def wrapped(*args, **kwargs):
-            request = args[-1]
+def is_exempt(request, handler):
+    """
+    Whether the request doesn't need to go through CSRF checks at all
+    """
+    if getattr(handler, MIDDLEWARE_SKIP_PROPERTY, False):
+        return True
 
-            if isinstance(request, aiohttp.web.View):
-                request = request.request
+    # Websocket upgrades, these are always GET requests
+    if request.method == "GET" and request.headers.get("Upgrade", "").lower() == "websocket":
+        return True
+
+    return is_static_route(request.match_info.route)
+
+
+async def protect_request(request, handler, *args, **kwargs):
+    """
+    Checks the token for protected methods and invokes the handler
+    """
+    if request.method not in UNPROTECTED_HTTP_METHODS:
+        if not isinstance(request, aiohttp.web.Request):
+            raise RuntimeError('Can\'t get request from handler params')
+
+        original_token = await storage.get_token(request)
+        if original_token is None or not await form_or_header_check(request, original_token):
+            raise aiohttp.web.HTTPForbidden(reason="csrf token mismatch")
+
+    raise_response = False
+
+    try:
+        response = await handler(*args, **kwargs)
+    except aiohttp.web.HTTPException as exc:
+        response = exc
+        raise_response = True
 
-            if request.method not in UNPROTECTED_HTTP_METHODS:
-                if not isinstance(request, aiohttp.web.Request):
-                    raise RuntimeError('Can\'t get request from handler params')
+    token = await storage.save_token(request)
 
-                original_token = await storage.get_token(request)
-                if not await form_or_header_check(request, original_token):
-                    raise aiohttp.web.HTTPForbidden(reason="csrf token mismatch")
+    if isinstance(response, aiohttp.web.Response) and token:
+        response.headers[HEADER_NAME] = token
 
-            raise_response = False
+    if raise_response:
+        raise response
 
-            token = await storage.save_token(request)
+    return response
 
-            try:
-                response = await handler(*args, **kwargs)
-            except aiohttp.web.HTTPException as exc:
-                response = exc
-                raise_response = True
 
-            if isinstance(response, aiohttp.web.Response) and token:
-                response.headers[HEADER_NAME] = token
+def csrf_protect(handler=None):
+    def wrapper(handler):
+        @functools.wraps(handler)
+        async def wrapped(*args, **kwargs):
+            request = args[-1]
 
-            if raise_response:
-                raise response
+            if isinstance(request, aiohttp.web.View):
+                request = request.request
 
-            return response
+            return await protect_request(request, handler, *args, **kwargs)
 
         setattr(wrapped, MIDDLEWARE_SKIP_PROPERTY, True)
 
@@ -141,19 +214,40 @@ def csrf_exempt(handler):
 
 @aiohttp.web.middleware
 async def csrf_middleware(request, handler):
-    if not getattr(handler, MIDDLEWARE_SKIP_PROPERTY, False):
-        handler = csrf_protect(handler=handler)
+    if is_exempt(request, handler):
+        return await handler(request)
 
-    return await handler(request)
+    return await protect_request(request, handler, request)
 
 
 class CsrfMiddleware(Middleware):
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.bypassed = 0
+
+    @property
+    def session_writes(self):
+        return storage.session_writes
+
+    @property
+    def avoided_writes(self):
+        """
+        Number of requests that didn't need to store a token in the session
+        """
+        return storage.avoided_writes
+
     async def on_process_request(self, request, handler):
-        return await csrf_middleware(request, handler)
+        if is_exempt(request, handler):
+            self.bypassed += 1
+            return await handler(request)
+
+        return await protect_request(request, handler, request)
 
     async def on_process_context(self, request):
-        token = await storage.get_token(request)
+        # Templates can't load the session, this makes the stored token available to them.
+        # The session is only written if a token has to be generated
+        await get_session(request)
         return {
-            "csrf_token": token,
-            "csrf": "<input type='hidden' value='%s' name='%s' />" % (token, FORM_FIELD_NAME)
+            "csrf_token": LazyToken(request),
+            "csrf": LazyTokenInput(request),
         }
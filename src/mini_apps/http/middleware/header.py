@@ -1,12 +1,19 @@
 import aiohttp
+from multidict import CIMultiDict
 
 from .base import Middleware
 
 
 class HeaderMiddleware(Middleware):
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.headers = CIMultiDict(
+            (header.replace("_", "-"), str(value))
+            for header, value in self.settings["headers"].items()
+        )
+
     def set_headers(self, response):
-        for header, value in self.settings["headers"].items():
-            response.headers[header.replace("_", "-")] = str(value)
+        response.headers.update(self.headers)
 
     async def on_process_request(self, request: aiohttp.web.Request, handler):
         """
@@ -4,9 +4,8 @@ Inspired by django.contrib.messages
 
 import dataclasses
 
-import aiohttp_session
-
 from .base import Middleware
+from ..session import get_session, set_value
 
 DEBUG = "debug"
 INFO = "info"
@@ -50,14 +49,18 @@ def add_message(request, level, message):
 
 
 class MessageMiddleware(Middleware):
+    skip_static = True
+
     async def on_process_request(self, request, handler):
-        session = await aiohttp_session.get_session(request)
+        session = await get_session(request)
         request[_REQUEST_KEY] = list(map(Message.from_json, session.get(_REQUEST_KEY, [])))
         response = await handler(request)
-        session[_REQUEST_KEY] = [m.to_json() for m in request[_REQUEST_KEY] if not m.rendered]
+        pending = [m.to_json() for m in request[_REQUEST_KEY] if not m.rendered]
+        if pending or _REQUEST_KEY in session:
+            set_value(session, _REQUEST_KEY, pending)
         return response
 
     async def on_process_context(self, request):
         return {
-            "messages": request[_REQUEST_KEY],
+            "messages": request.get(_REQUEST_KEY, []),
         }
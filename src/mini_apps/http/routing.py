@@ -0,0 +1,100 @@
+import aiohttp.web
+import aiohttp.web_urldispatcher
+from aiohttp.web_urldispatcher import PrefixedSubAppResource, MatchedSubAppResource, MatchInfoError
+
+from .utils import NakedSubAppResource
+
+
+class FlatUrlDispatcher(aiohttp.web_urldispatcher.UrlDispatcher):
+    """
+    Router that indexes the routes of all sub-apps in a single table when frozen
+
+    Resolving a path only looks up its prefixes in the table instead of
+    going through the router of each sub-app in turn.
+    Matches get the same app stack they would get from nested resolution,
+    so sub-app middleware, names and current_app work as usual.
+
+    Unlike nested resolution, routes in naked sub-apps don't lose against
+    less specific routes registered earlier in the parent app.
+    """
+    def __init__(self):
+        super().__init__()
+        # Index key -> list of (resource, sub-app stack)
+        self.flat_index = None
+        # Index key -> sub-app stack handling errors under that path
+        self.scopes = {}
+
+    def freeze(self):
+        super().freeze()
+        self.build_index()
+
+    def build_index(self):
+        """
+        Builds the flat index, sub-apps must be added before this
+        """
+        index = {}
+        self.scopes = {}
+        if not self.index_router(self, (), index):
+            # Domain matching doesn't work with path indexing
+            self.flat_index = None
+            return
+        self.flat_index = index
+
+    def index_router(self, router, apps, index, scope_key="/"):
+        """
+        Adds all the leaf resources in router to the index
+
+        :return: False if the routes cannot be indexed
+        """
+        for resource in router.resources():
+            if isinstance(resource, MatchedSubAppResource):
+                return False
+            elif isinstance(resource, PrefixedSubAppResource):
+                sub_apps = apps + (resource._app,)
+                key = self._get_resource_index_key(resource)
+                self.scopes.setdefault(key, sub_apps)
+                if not self.index_router(resource._app.router, sub_apps, index, key):
+                    return False
+            elif isinstance(resource, NakedSubAppResource):
+                sub_apps = apps + (resource.app,)
+                self.scopes.setdefault(scope_key, sub_apps)
+                if not self.index_router(resource.app.router, sub_apps, index, scope_key):
+                    return False
+            else:
+                index.setdefault(self._get_resource_index_key(resource), []).append((resource, apps))
+        return True
+
+    @staticmethod
+    def add_apps(match_info, apps):
+        for app in reversed(apps):
+            match_info.add_app(app)
+        return match_info
+
+    async def resolve(self, request: aiohttp.web.Request):
+        if self.flat_index is None:
+            return await super().resolve(request)
+
+        allowed_methods = set()
+        scope = None
+        url_part = request.rel_url.path_safe
+        while url_part:
+            for resource, apps in self.flat_index.get(url_part, ()):
+                match_info, allowed = await resource.resolve(request)
+                if match_info is not None:
+                    return self.add_apps(match_info, apps)
+                allowed_methods |= allowed
+
+            if scope is None:
+                scope = self.scopes.get(url_part)
+
+            if url_part == "/":
+                break
+            url_part = url_part.rpartition("/")[0] or "/"
+
+        if allowed_methods:
+            error = MatchInfoError(aiohttp.web.HTTPMethodNotAllowed(request.method, allowed_methods))
+        else:
+            error = MatchInfoError(aiohttp.web.HTTPNotFound())
+
+        # Errors are handled by the innermost sub-app, as with nested resolution
+        return self.add_apps(error, scope or ())
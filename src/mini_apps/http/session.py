@@ -0,0 +1,316 @@
+"""
+Request-scoped session handling on top of aiohttp_session
+"""
+import copy
+import time
+import secrets
+
+import peewee
+import aiohttp.web
+import aiohttp_session
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+
+from ..cache import LruCache
+from ..db import BaseModel, JSONField
+
+
+SESSION_STATS_KEY = "mini_apps_session_stats"
+
+
+class SessionStats:
+    """
+    Session handling cost for a single request
+    """
+    def __init__(self):
+        self.load_time = 0
+        self.save_time = 0
+        self.snapshot = None
+        self.saved = False
+
+    @property
+    def total_time(self):
+        return self.load_time + self.save_time
+
+    def server_timing(self):
+        """
+        Value for the Server-Timing header
+        """
+        return "session-load;dur=%.3f, session-save;dur=%.3f" % (self.load_time * 1000, self.save_time * 1000)
+
+
+def session_stats(request: aiohttp.web.Request) -> SessionStats:
+    stats = request.get(SESSION_STATS_KEY)
+    if stats is None:
+        stats = request[SESSION_STATS_KEY] = SessionStats()
+    return stats
+
+
+async def get_session(request: aiohttp.web.Request) -> aiohttp_session.Session:
+    """
+    Returns the session for the request, it's decoded at most once per request
+    """
+    session = request.get(aiohttp_session.SESSION_KEY)
+    if session is not None:
+        return session
+
+    stats = session_stats(request)
+    start = time.perf_counter()
+    session = await aiohttp_session.get_session(request)
+    stats.load_time += time.perf_counter() - start
+    stats.snapshot = copy.deepcopy(dict(session))
+    return session
+
+
+async def renew_session(request: aiohttp.web.Request):
+    """
+    Moves the session data to a new session id, call it when the user changes to prevent session fixation
+
+    Only server-side storages have ids to renew, cookie sessions are left as they are
+    """
+    session = await get_session(request)
+    storage = request.get(aiohttp_session.STORAGE_KEY)
+    if not isinstance(storage, ServerSideStorage) or session.identity is None:
+        return
+
+    await storage.delete_data(session.identity)
+    # The storage assigns a new id on save
+    session._new = True
+    session.set_new_identity(None)
+    session.changed()
+    session_stats(request).snapshot = None
+
+
+def set_value(session: aiohttp_session.Session, key: str, value):
+    """
+    Sets a session value, leaving the session untouched if the value is the same
+    """
+    if key not in session or session[key] != value:
+        session[key] = value
+
+
+class SessionManager:
+    """
+    Replaces the aiohttp_session middleware, avoiding to save sessions that haven't changed
+
+    :param server_timing: If True, responses include a Server-Timing header with the session cost
+    """
+    def __init__(self, storage: aiohttp_session.AbstractStorage, server_timing=False):
+        self.storage = storage
+        self.server_timing = server_timing
+        self.requests = 0
+        self.saves = 0
+        self.skipped_saves = 0
+        self.total_time = 0
+
+    def setup(self, app: aiohttp.web.Application):
+        app.middlewares.append(self.process_request)
+
+    def needs_saving(self, session: aiohttp_session.Session, stats: SessionStats):
+        if not session._changed:
+            return False
+
+        # Loaded outside get_session(), we can't tell what changed
+        if stats.snapshot is None:
+            return True
+
+        # Saving refreshes the expiry time
+        if session.max_age is not None:
+            return True
+
+        return dict(session) != stats.snapshot
+
+    @aiohttp.web.middleware
+    async def process_request(self, request: aiohttp.web.Request, handler):
+        request[aiohttp_session.STORAGE_KEY] = self.storage
+        raise_response = False
+
+        try:
+            response = await handler(request)
+        except aiohttp.web.HTTPException as exc:
+            response = exc
+            raise_response = True
+
+        if not isinstance(response, (aiohttp.web.Response, aiohttp.web.HTTPException)):
+            # Websocket or streaming
+            return response
+
+        session = request.get(aiohttp_session.SESSION_KEY)
+        if session is not None:
+            stats = session_stats(request)
+            if self.needs_saving(session, stats):
+                start = time.perf_counter()
+                await self.storage.save_session(request, response, session)
+                stats.save_time = time.perf_counter() - start
+                stats.saved = True
+                self.saves += 1
+            else:
+                self.skipped_saves += 1
+
+            self.requests += 1
+            self.total_time += stats.total_time
+            if self.server_timing:
+                response.headers.add("Server-Timing", stats.server_timing())
+
+        if raise_response:
+            raise response
+
+        return response
+
+
+class ServerSideStorage(aiohttp_session.AbstractStorage):
+    """
+    Storage that keeps session data on the server, the cookie only holds the session id
+
+    :param ttl: Number of seconds a session is kept after its last use
+    """
+    def __init__(self, ttl=24*60*60, **kwargs):
+        super().__init__(**kwargs)
+        self.ttl = ttl
+
+    def new_key(self):
+        return secrets.token_urlsafe(24)
+
+    async def load_session(self, request: aiohttp.web.Request):
+        key = self.load_cookie(request)
+        data = None
+        if key:
+            data = await self.load_data(key)
+
+        if data is None:
+            return aiohttp_session.Session(None, data=None, new=True, max_age=self.max_age)
+
+        return aiohttp_session.Session(key, data=data, new=False, max_age=self.max_age)
+
+    async def save_session(self, request: aiohttp.web.Request, response: aiohttp.web.StreamResponse, session: aiohttp_session.Session):
+        key = session.identity
+
+        if session.empty:
+            if key:
+                await self.delete_data(key)
+                self.save_cookie(response, "", max_age=session.max_age)
+            return
+
+        if key is None:
+            key = self.new_key()
+            session.set_new_identity(key)
+            self.save_cookie(response, key, max_age=session.max_age)
+        elif session.max_age is not None:
+            # Refresh the cookie expiry
+            self.save_cookie(response, key, max_age=session.max_age)
+
+        await self.save_data(key, self._get_session_data(session))
+
+    def needs_refresh(self, expires):
+        """
+        Whether the expiry time of a loaded session should be pushed forward
+        """
+        return expires - time.time() < self.ttl / 2
+
+    async def load_data(self, key: str):
+        """
+        Returns the stored data for the session or None
+        """
+        raise NotImplementedError
+
+    async def save_data(self, key: str, data: dict):
+        raise NotImplementedError
+
+    async def delete_data(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryStorage(ServerSideStorage):
+    """
+    Keeps sessions in memory, the least recently used sessions are dropped first
+
+    :param max_sessions: Maximum number of sessions to keep
+    """
+    def __init__(self, max_sessions=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = LruCache(max_sessions, self.ttl, clock=time.time)
+
+    async def load_data(self, key: str):
+        data = self.sessions.get(key)
+        if data is not None:
+            # Active sessions are kept alive, like DatabaseStorage does with needs_refresh()
+            self.sessions.touch(key)
+        return data
+
+    async def save_data(self, key: str, data: dict):
+        self.sessions.put(key, data)
+
+    async def delete_data(self, key: str):
+        self.sessions.pop(key)
+
+
+class StoredSession(BaseModel):
+    key = peewee.CharField(primary_key=True, max_length=64)
+    data = JSONField()
+    expires = peewee.FloatField(index=True)
+
+
+class DatabaseStorage(ServerSideStorage):
+    """
+    Keeps sessions in the database
+
+    :param purge_interval: Number of saves between deleting expired sessions
+    """
+    def __init__(self, purge_interval=100, **kwargs):
+        super().__init__(**kwargs)
+        self.purge_interval = purge_interval
+        self.saves = 0
+
+    def database_models(self):
+        return [StoredSession]
+
+    async def load_data(self, key: str):
+        stored = StoredSession.get_or_none(StoredSession.key == key)
+        if stored is None:
+            return None
+
+        if stored.expires < time.time():
+            stored.delete_instance()
+            return None
+
+        if self.needs_refresh(stored.expires):
+            StoredSession.update(expires=time.time() + self.ttl).where(StoredSession.key == key).execute()
+
+        return stored.data
+
+    async def save_data(self, key: str, data: dict):
+        StoredSession.replace(key=key, data=data, expires=time.time() + self.ttl).execute()
+
+        self.saves += 1
+        if self.saves >= self.purge_interval:
+            self.saves = 0
+            StoredSession.delete().where(StoredSession.expires < time.time()).execute()
+
+    async def delete_data(self, key: str):
+        StoredSession.delete().where(StoredSession.key == key).execute()
+
+
+def storage_from_settings(settings):
+    """
+    Creates the session storage based on the `session-storage` settings of the http server
+
+    The backend is one of "cookie" (default), "memory" or "database"
+    """
+    # Global settings are meant for the apps, a global `session` is the Telethon session name
+    session_settings = dict(settings.get_own("session-storage", {}))
+    backend = session_settings.pop("backend", "cookie")
+    kwargs = {
+        "cookie_name": session_settings.pop("cookie-name", "AIOHTTP_SESSION"),
+        "max_age": session_settings.pop("max-age", None),
+    }
+
+    if backend == "cookie":
+        return EncryptedCookieStorage(settings["secret-key"], **kwargs)
+
+    kwargs["ttl"] = session_settings.pop("ttl", 24*60*60)
+
+    if backend == "memory":
+        return MemoryStorage(max_sessions=session_settings.pop("max-sessions", 10000), **kwargs)
+    elif backend == "database":
+        return DatabaseStorage(**kwargs)
+
+    raise ValueError("Unknown session backend %r" % backend)
@@ -0,0 +1,87 @@
+import urllib.parse
+
+import aiohttp.web
+from aiohttp.web_urldispatcher import PlainResource, DynamicResource, PrefixedSubAppResource
+from yarl import URL
+
+from .utils import NakedSubAppResource
+
+
+# Characters that aren't quoted in paths, same as aiohttp's url_for()
+PATH_SAFE = "/@!$&'()*+,;="
+
+
+class UrlBuilder:
+    """
+    Builds absolute URLs for a named resource
+    """
+    def __init__(self, base_url: str, resource):
+        self.base_url = base_url
+        self.resource = resource
+        self.string = None
+        self.formatter = None
+
+        if isinstance(resource, PlainResource):
+            self.string = base_url + str(resource.url_for())
+            self.url = URL(self.string, encoded=True)
+        elif isinstance(resource, DynamicResource):
+            self.formatter = base_url.replace("{", "{{").replace("}", "}}") + resource._formatter
+
+    def url_string(self, **kwargs):
+        if self.string is not None and not kwargs:
+            return self.string
+
+        if self.formatter is not None:
+            return self.formatter.format_map({
+                key: urllib.parse.quote(str(value), safe=PATH_SAFE)
+                for key, value in kwargs.items()
+            })
+
+        return self.base_url + str(self.resource.url_for(**kwargs))
+
+    def build_url(self, **kwargs):
+        if self.string is not None and not kwargs:
+            return self.url
+        return URL(self.url_string(**kwargs), encoded=True)
+
+
+class UrlMap:
+    """
+    Reverse routing table for an app and all its sub-apps
+
+    Names are in the form `app:name`, as in HttpServer.url()
+    """
+    def __init__(self, base_url: str, app: aiohttp.web.Application):
+        self.base_url = base_url
+        self.builders = {}
+        self.app_prefixes = {app: ""}
+        self.add_router(app.router, "")
+
+    def add_router(self, router, prefix: str):
+        for name, resource in router.named_resources().items():
+            full_name = prefix + name
+            if isinstance(resource, PrefixedSubAppResource):
+                self.add_app(resource._app, full_name + ":")
+            elif isinstance(resource, NakedSubAppResource):
+                self.add_app(resource.app, full_name + ":")
+            else:
+                self.builders[full_name] = UrlBuilder(self.base_url, resource)
+
+    def add_app(self, app: aiohttp.web.Application, prefix: str):
+        self.app_prefixes[app] = prefix
+        self.add_router(app.router, prefix)
+
+    def builder(self, url_name: str, app: aiohttp.web.Application = None):
+        """
+        Returns the UrlBuilder for the given name
+
+        If app is not None, names relative to that app take precedence
+        """
+        if app is not None:
+            prefix = self.app_prefixes.get(app)
+            if prefix:
+                builder = self.builders.get(prefix + url_name)
+                if builder is not None:
+                    return builder
+
+        return self.builders[url_name]
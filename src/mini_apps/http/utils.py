@@ -1,13 +1,17 @@
+import os
 import pathlib
 
 import aiohttp.web
 import aiohttp.web_urldispatcher
 
+from .file_cache import FileCache
+
 
 class FileResource(aiohttp.web_urldispatcher.PlainResource):
-    def __init__(self, prefix: str, file, name: str = None):
+    def __init__(self, prefix: str, file, name: str = None, file_cache: FileCache = None):
         super().__init__(prefix, name=name)
         self.file = file
+        self.file_cache = file_cache
         self.register_route(aiohttp.web_urldispatcher.ResourceRoute("GET", self._handle, self))
         self.register_route(aiohttp.web_urldispatcher.ResourceRoute("HEAD", self._handle, self))
 
@@ -18,6 +22,10 @@ class FileResource(aiohttp.web_urldispatcher.PlainResource):
         }
 
     async def _handle(self, request: aiohttp.web.Request):
+        if self.file_cache and "Range" not in request.headers:
+            cached = await self.file_cache.get(self.file)
+            if cached:
+                return cached.response(request)
         return aiohttp.web.FileResponse(self.file)
 
     def __repr__(self):
@@ -26,16 +34,67 @@ class FileResource(aiohttp.web_urldispatcher.PlainResource):
         ))
 
 
+class CachedStaticResource(aiohttp.web_urldispatcher.StaticResource):
+    """
+    Static directory that serves small files from a FileCache
+    """
+    def __init__(self, prefix: str, directory, *, file_cache: FileCache, **kwargs):
+        super().__init__(prefix, directory, **kwargs)
+        self.file_cache = file_cache
+
+    def _cached_path(self, filename: str):
+        """
+        Returns the file path for filename, or None if it should go through the default handler
+        """
+        if not filename or pathlib.Path(filename).is_absolute():
+            return None
+
+        path = pathlib.Path(os.path.normpath(self._directory / filename))
+        try:
+            path.relative_to(self._directory)
+            if not self._follow_symlinks:
+                path.resolve().relative_to(self._directory)
+        except (ValueError, OSError, RuntimeError):
+            return None
+
+        return path
+
+    async def _handle(self, request: aiohttp.web.Request):
+        if "Range" not in request.headers:
+            # The path is validated first so the cache is never a way around the checks
+            path = self._cached_path(request.match_info["filename"])
+            if path is not None:
+                cached = await self.file_cache.get(path)
+                if cached is not None:
+                    return cached.response(request)
+
+        return await super()._handle(request)
+
+
 class ExtendedApplication(aiohttp.web.Application):
     """
     aiohttp application with extra stuff
+
+    :param url_dispatcher: Custom router (aiohttp deprecated its own router argument)
     """
-    def add_static_path(self, prefix, path: pathlib.Path, *args, **kwargs):
+    def __init__(self, *, url_dispatcher: aiohttp.web.UrlDispatcher = None, **kwargs):
+        super().__init__(**kwargs)
+        if url_dispatcher is not None:
+            self._router = url_dispatcher
+
+    def add_static_path(self, prefix, path: pathlib.Path, *args, file_cache: FileCache = None, **kwargs):
         """
         Registers a static path to the app
+
+        :param file_cache: If not None, small files will be served from memory
         """
         if path.is_file():
-            self.router.register_resource(FileResource(prefix, path, *args, **kwargs))
+            self.router.register_resource(FileResource(prefix, path, *args, file_cache=file_cache, **kwargs))
+        elif file_cache is not None:
+            # Same as UrlDispatcher.add_static
+            if prefix.endswith("/"):
+                prefix = prefix[:-1]
+            self.router.register_resource(CachedStaticResource(prefix, path, *args, file_cache=file_cache, **kwargs))
         else:
             self.router.add_static(prefix, path, *args, **kwargs)
 
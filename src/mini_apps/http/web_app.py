@@ -11,12 +11,17 @@ import aiohttp_jinja2
 import jinja2
 from markupsafe import Markup
 
+from .. import metrics
 from ..service import Service, ServiceStatus, Client
 from ..apps.auth.user import UserFilter
 from .utils import ExtendedApplication
 from .route_info import RouteInfo
 
 
+http_request_time = metrics.histogram("http_request_duration_seconds", "Time spent in HTTP handlers", ["app", "handler"])
+http_responses = metrics.counter("http_responses_total", "HTTP responses by status code", ["app", "status"])
+
+
 class ViewHandler:
     def __init__(self, instance: "WebApp", handler):
         self.handler = handler.__get__(instance, instance.__class__)
@@ -161,10 +166,14 @@ class WebApp(Service):
         """
         Invokes the actual handler and manages exception
         """
-        try:
-            return await handler(request, **kwargs)
-        except Exception:
-            return await self.on_http_exception(request)
+        with metrics.timer(http_request_time, self.name, handler.__name__):
+            try:
+                response = await handler(request, **kwargs)
+            except Exception:
+                response = await self.on_http_exception(request)
+
+        http_responses.labels(self.name, getattr(response, "status", 0)).inc()
+        return response
 
     async def on_http_exception(self, request):
         """
@@ -182,9 +191,7 @@ class WebApp(Service):
         return aiohttp.web.Response(body=traceback.format_exc(), status=500)
 
     def get_url(self, url_name, **kwargs):
-        if url_name in self.app.router.named_resources():
-            kwargs["app"] = self.app
-        return str(self.http.url(url_name, **kwargs))
+        return self.http.url_string(url_name, app=self.app, **kwargs)
 
 
 def format_minutes(minutes):
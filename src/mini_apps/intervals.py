@@ -0,0 +1,78 @@
+import bisect
+import operator
+
+
+class IntervalIndex:
+    """
+    Immutable index of items spanning a time interval, sorted by start
+
+    Items overlapping a point are found in O(log n + k) with a segment tree
+    holding the maximum finish of each range of items
+
+    :param start: Callable returning the start of an item
+    :param finish: Callable returning the finish of an item
+    """
+    def __init__(self, items, start=operator.attrgetter("start"), finish=operator.attrgetter("finish")):
+        self.items = sorted(items, key=start)
+        self.starts = [start(item) for item in self.items]
+        finishes = [finish(item) for item in self.items]
+
+        self.size = 1
+        while self.size < len(finishes):
+            self.size *= 2
+
+        # Padding is never reported as queries are bounded by the number of items
+        padding = [min(finishes)] if finishes else [None]
+        self.tree = [None] * self.size + finishes + padding * (self.size - len(finishes))
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def _collect(self, node, low, high, limit, time, out):
+        if low >= limit or self.tree[node] < time:
+            return
+
+        if node >= self.size:
+            out.append(self.items[low])
+            return
+
+        middle = (low + high) // 2
+        self._collect(2 * node, low, middle, limit, time, out)
+        self._collect(2 * node + 1, middle, high, limit, time, out)
+
+    def ongoing(self, time):
+        """
+        Returns the items with start <= time <= finish, sorted by start
+        """
+        out = []
+        if self.items:
+            self._collect(1, 0, self.size, bisect.bisect_right(self.starts, time), time, out)
+        return out
+
+    def upcoming(self, time, count=None):
+        """
+        Returns the items starting after time, sorted by start
+
+        :param count: Maximum number of items to return, None for all
+        """
+        first = bisect.bisect_right(self.starts, time)
+        return self.items[first:] if count is None else self.items[first:first+count]
+
+    def first_unfinished(self, time):
+        """
+        Returns the first item (by start) with finish > time, None if all items are finished
+        """
+        if not self.items or not self.tree[1] > time:
+            return None
+
+        node = 1
+        while node < self.size:
+            node *= 2
+            if not self.tree[node] > time:
+                node += 1
+        return self.items[node - self.size]
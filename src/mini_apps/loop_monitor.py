@@ -0,0 +1,156 @@
+import sys
+import time
+import asyncio
+import inspect
+import datetime
+import threading
+import traceback
+import collections
+
+from . import metrics
+from .service import BaseService, ServiceStatus
+
+
+loop_lag = metrics.histogram("event_loop_lag_seconds", "Delay in scheduling event loop callbacks")
+loop_blocked = metrics.counter("event_loop_blocked_total", "Number of times the event loop has been blocked", ["service"])
+
+
+class BlockedSample:
+    """
+    Stack captured while the event loop was blocked
+    """
+    def __init__(self, service: str, task: str, duration: float, stack: str):
+        self.service = service
+        self.task = task
+        self.duration = duration
+        self.stack = stack
+        self.time = datetime.datetime.now()
+
+
+class BlockedStats:
+    """
+    Blocking time attributed to a single service
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+class LoopMonitor(BaseService):
+    """
+    Measures the event loop lag and samples the stack of code blocking the loop
+
+    Blocking time is attributed to a service by task name or,
+    failing that, by the module of the code on the stack
+    """
+    def __init__(self, settings):
+        super().__init__(settings)
+        # Seconds between loop lag measurements
+        self.interval = settings.get("interval", 0.1)
+        # Seconds the loop needs to be blocked to capture the stack
+        self.threshold = settings.get("threshold", 0.1)
+        self.lag = metrics.HistogramChild()
+        self.last_lag = 0
+        self.blocks = collections.deque(maxlen=settings.get("history", 20))
+        self.blocked_by = collections.defaultdict(BlockedStats)
+        self.loop = None
+        self.loop_thread = None
+        self.heartbeat = 0
+        self.pending = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.service_modules = {}
+
+    def find_service_modules(self):
+        """
+        Maps source file names to the services defined in them
+        """
+        modules = collections.defaultdict(list)
+        for name, task in self.server.services.items():
+            try:
+                modules[inspect.getfile(type(task.service))].append(name)
+            except TypeError:
+                pass
+        return {filename: "/".join(names) for filename, names in modules.items()}
+
+    def attribute(self, task_name, frame):
+        """
+        Returns the name of the service responsible for the blocking code
+        """
+        if task_name in self.server.services:
+            return task_name
+
+        while frame is not None:
+            service = self.service_modules.get(frame.f_code.co_filename)
+            if service:
+                return service
+            frame = frame.f_back
+
+        return task_name or "unknown"
+
+    def sample(self, duration):
+        """
+        Captures the stack of the event loop thread, called from the watchdog thread
+        """
+        frame = sys._current_frames().get(self.loop_thread)
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_name() if task else None
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        return BlockedSample(self.attribute(task_name, frame), task_name, duration, stack)
+
+    def watch(self):
+        """
+        Watchdog thread, samples the loop when it doesn't run for too long
+        """
+        while not self.stopped.wait(self.threshold / 2):
+            blocked = time.monotonic() - self.heartbeat - self.interval
+            if blocked > self.threshold:
+                with self.lock:
+                    if self.pending is None:
+                        self.pending = self.sample(blocked)
+
+    def record_lag(self, lag):
+        self.last_lag = lag
+        self.lag.observe(lag)
+        loop_lag.observe(lag)
+
+        with self.lock:
+            sample = self.pending
+            self.pending = None
+
+        if sample:
+            # The loop is running again, so we know how long it was blocked for
+            sample.duration = max(sample.duration, lag)
+            self.blocks.appendleft(sample)
+            self.blocked_by[sample.service].add(sample.duration)
+            loop_blocked.labels(sample.service).inc()
+            self.log.warning("Event loop blocked for %.3fs by %s", sample.duration, sample.service)
+
+    async def run(self):
+        self.status = ServiceStatus.Starting
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.service_modules = self.find_service_modules()
+        self.stopped.clear()
+        self.heartbeat = time.monotonic()
+        threading.Thread(target=self.watch, name=self.name, daemon=True).start()
+        self.status = ServiceStatus.Running
+
+        try:
+            while not self.stopped.is_set():
+                start = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self.heartbeat = time.monotonic()
+                self.record_lag(max(self.heartbeat - start - self.interval, 0))
+        finally:
+            self.stopped.set()
+            self.status = ServiceStatus.Disconnected
+
+    async def stop(self):
+        self.stopped.set()
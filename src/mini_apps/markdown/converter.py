@@ -0,0 +1,29 @@
+from ..cache import LruCache, content_key
+
+
+class MarkdownConverter:
+    """
+    Converts markdown to HTML, reusing the same Markdown instance
+    and caching the output by content
+
+    :param extensions: Passed to markdown.Markdown
+    """
+    def __init__(self, extensions=(), cache_size=1024):
+        self.extensions = extensions
+        self.cache = LruCache(cache_size)
+        self.md = None
+
+    def markdown(self):
+        if self.md is None:
+            import markdown
+            self.md = markdown.Markdown(extensions=list(self.extensions))
+        return self.md
+
+    def convert(self, text: str):
+        key = content_key(text)
+        html = self.cache.get(key)
+        if html is None:
+            # Clears the state left by the previous document
+            html = self.markdown().reset().convert(text)
+            self.cache.put(key, html)
+        return html
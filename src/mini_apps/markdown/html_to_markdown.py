@@ -1,5 +1,7 @@
 import xml.etree.ElementTree as etree
 
+from ..cache import memoize_text
+
 
 def wrap_element(element, mark, list_depth=0):
     content = content_to_markdown(element, list_depth)
@@ -51,6 +53,7 @@ def element_to_markdown(element: etree.Element, list_depth=0):
         return content_to_markdown(element, list_depth).strip("\n") + "\n"
 
 
+@memoize_text()
 def html_to_markdown(html):
     """
     Converts an HTML string to telegram markdown
@@ -0,0 +1,336 @@
+"""
+Lightweight performance metrics
+
+Metrics are defined at module level and cost a single flag check while
+collection is disabled (the default).
+"""
+import math
+import time
+
+
+class NullChild:
+    """
+    Stand-in for labelled metrics while collection is disabled
+    """
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_CHILD = NullChild()
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    """
+    HDR-style histogram with log-linear buckets
+
+    Values are stored with a relative error of about 1 / sub_buckets
+
+    :param unit: Smallest distinguishable value
+    """
+    def __init__(self, unit=1e-6, sub_bits=7):
+        self.unit = unit
+        self.sub_bits = sub_bits
+        self.sub_buckets = 1 << sub_bits
+        self.half = self.sub_buckets // 2
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        scaled = int(value / self.unit)
+        if scaled < self.sub_buckets:
+            return max(scaled, 0)
+        shift = scaled.bit_length() - self.sub_bits
+        return shift * self.half + (scaled >> shift)
+
+    def bucket_range(self, index):
+        """
+        Returns the lower and upper bound of a bucket
+        """
+        if index < self.sub_buckets:
+            return index * self.unit, (index + 1) * self.unit
+        shift = index // self.half - 1
+        lower = (index - shift * self.half) << shift
+        return lower * self.unit, (lower + (1 << shift)) * self.unit
+
+    def observe(self, value):
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def quantile(self, q):
+        """
+        Returns the approximate value at the given quantile (0-1)
+        """
+        if not self.count:
+            return 0
+
+        target = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                lower, upper = self.bucket_range(index)
+                return min(max((lower + upper) / 2, self.min), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """
+        Returns the number of values lower or equal to each bound
+        """
+        counts = [0] * len(bounds)
+        for index, count in self.buckets.items():
+            upper = self.bucket_range(index)[1]
+            for i, bound in enumerate(bounds):
+                # Tolerates rounding in the bucket bounds
+                if upper <= bound * 1.000001:
+                    counts[i] += count
+                    break
+        total = 0
+        for i in range(len(counts)):
+            total += counts[i]
+            counts[i] = total
+        return counts
+
+
+class Metric:
+    """
+    Base class for metrics, values are kept per combination of label values
+    """
+    type = None
+    child_class = None
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+
+    def labels(self, *values):
+        """
+        Returns the metric for the given label values
+        """
+        if not self.registry.enabled:
+            return NULL_CHILD
+
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.child_class()
+        return child
+
+    def clear(self):
+        self.children = {}
+
+    def format_labels(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+
+    def prometheus_samples(self, values, child):
+        yield self.name + self.format_labels(values), child.value
+
+    def prometheus(self):
+        """
+        Returns the metric in the Prometheus text format
+        """
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        for values, child in sorted(self.children.items()):
+            for sample, value in self.prometheus_samples(values, child):
+                lines.append("%s %s" % (sample, format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+    child_class = CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+    child_class = GaugeChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    child_class = HistogramChild
+
+    # Exported bucket bounds, in seconds
+    bounds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def prometheus_samples(self, values, child):
+        for bound, count in zip(self.bounds, child.cumulative(self.bounds)):
+            yield self.name + "_bucket" + self.format_labels(values, [("le", format_value(bound))]), count
+        yield self.name + "_bucket" + self.format_labels(values, [("le", "+Inf")]), child.count
+        yield self.name + "_sum" + self.format_labels(values), child.sum
+        yield self.name + "_count" + self.format_labels(values), child.count
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Timer:
+    """
+    Context manager that observes the elapsed time into a histogram
+    """
+    def __init__(self, child: HistogramChild):
+        self.child = child
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics, nothing is recorded until enabled
+    """
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+
+    def register(self, cls, name, help, labels=()):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(self, name, help, labels)
+        elif not isinstance(metric, cls):
+            raise ValueError("Metric %s is already registered as a %s" % (name, metric.type))
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self.register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels=()) -> Histogram:
+        return self.register(Histogram, name, help, labels)
+
+    def timer(self, histogram: Histogram, *labels):
+        """
+        Returns a context manager that times its body
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(histogram.labels(*labels))
+
+    def prometheus(self):
+        """
+        Returns all the metrics in the Prometheus text format
+        """
+        return "\n".join(metric.prometheus() for metric in self.metrics.values()) + "\n"
+
+    def summary(self):
+        """
+        Returns a list of dicts describing the recorded values, for display
+        """
+        rows = []
+        for metric in self.metrics.values():
+            for values, child in sorted(metric.children.items()):
+                row = {
+                    "name": metric.name,
+                    "type": metric.type,
+                    "labels": ", ".join("%s=%s" % pair for pair in zip(metric.label_names, values)),
+                }
+                if isinstance(child, HistogramChild):
+                    row.update(
+                        count=child.count,
+                        mean=child.mean,
+                        p50=child.quantile(0.5),
+                        p90=child.quantile(0.9),
+                        p99=child.quantile(0.99),
+                        max=child.max,
+                    )
+                else:
+                    row["value"] = child.value
+                rows.append(row)
+        return rows
+
+
+registry = MetricsRegistry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+timer = registry.timer
@@ -0,0 +1,136 @@
+import time
+import random
+import asyncio
+
+from . import metrics
+from .service import BaseService, ServiceStatus
+
+
+poll_time = metrics.histogram("poll_duration_seconds", "Time taken by polling runs", ["service"])
+poll_runs = metrics.counter("poll_runs_total", "Number of polling runs", ["service", "result"])
+poll_last_duration = metrics.gauge("poll_last_duration_seconds", "Duration of the last polling run", ["service"])
+poll_last_success = metrics.gauge("poll_last_success_timestamp_seconds", "Time of the last successful polling run", ["service"])
+
+
+class PollingService(BaseService):
+    """
+    Calls callback periodically
+
+    Failed runs are retried with exponential backoff and a random jitter
+    is applied to all delays, so services started together don't poll in sync
+
+    :param callback: Coroutine function to call
+    :param delay_seconds: Seconds between successful runs
+    :param warm_up: Optional coroutine function called with the result of each poll,
+        to prepare the new data before it's used
+    :param timeout: Maximum number of seconds for a run (callback and warm up), None for no limit
+    :param jitter: Fraction of the delay randomly added or removed
+    :param retry_seconds: Delay after the first failure, it doubles for each consecutive failure
+    :param max_backoff: Maximum delay after failures, defaults to 4 times delay_seconds
+    """
+    def __init__(self, settings, callback, delay_seconds, warm_up=None, timeout=None, jitter=0.1, retry_seconds=30, max_backoff=None):
+        super().__init__(settings)
+        self.callback = callback
+        self.warm_up = warm_up
+        self.delay_seconds = delay_seconds
+        self.timeout = timeout
+        self.jitter = jitter
+        self.retry_seconds = retry_seconds
+        self.max_backoff = max_backoff if max_backoff is not None else delay_seconds * 4
+        self.keep_running = False
+        self.wake = asyncio.Event()
+        # Run in progress, if any
+        self.current = None
+        self.failures = 0
+        self.last_duration = None
+        self.last_success = None
+
+    async def run_once(self):
+        if self.warm_up:
+            await self.warm_up(await self.callback())
+        else:
+            await self.callback()
+
+    async def poll(self):
+        """
+        Runs the callback once
+
+        :return: Whether the run succeeded
+        """
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.run_once(), self.timeout)
+            result = "success"
+        except asyncio.TimeoutError:
+            self.log.warning("Poll timed out after %ss", self.timeout)
+            result = "timeout"
+        except Exception:
+            self.log_exception("Poll failed")
+            result = "error"
+
+        self.last_duration = time.perf_counter() - start
+        poll_time.labels(self.name).observe(self.last_duration)
+        poll_last_duration.labels(self.name).set(self.last_duration)
+        poll_runs.labels(self.name, result).inc()
+
+        if result == "success":
+            self.failures = 0
+            self.last_success = time.time()
+            poll_last_success.labels(self.name).set(self.last_success)
+            return True
+
+        self.failures += 1
+        return False
+
+    def next_delay(self):
+        """
+        Returns the number of seconds to wait before the next run
+        """
+        if self.failures:
+            delay = min(self.retry_seconds * 2 ** (self.failures - 1), self.max_backoff)
+        else:
+            delay = self.delay_seconds
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def trigger(self):
+        """
+        Starts a run without waiting for the next scheduled one
+
+        :return: Awaitable for the run, if a run is already in progress that one is returned instead
+        """
+        if self.current is None or self.current.done():
+            self.current = asyncio.ensure_future(self.poll())
+            # Restarts the delay from the end of this run
+            self.wake.set()
+        return asyncio.shield(self.current)
+
+    async def run(self):
+        self.status = ServiceStatus.Starting
+        self.keep_running = True
+        self.status = ServiceStatus.Running
+
+        while self.keep_running:
+            if self.current is None or self.current.done():
+                self.current = asyncio.ensure_future(self.poll())
+
+            try:
+                await asyncio.shield(self.current)
+            except asyncio.CancelledError:
+                # Only the run has been cancelled, by stop()
+                if not self.current.cancelled():
+                    raise
+
+            self.wake.clear()
+            if self.keep_running:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.next_delay())
+                except asyncio.TimeoutError:
+                    pass
+
+        self.status = ServiceStatus.Disconnected
+
+    async def stop(self):
+        self.keep_running = False
+        self.wake.set()
+        if self.current is not None:
+            self.current.cancel()
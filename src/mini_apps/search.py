@@ -0,0 +1,138 @@
+import re
+import bisect
+import html
+
+
+token_re = re.compile(r"\w+")
+tag_re = re.compile(r"<[^>]*>")
+
+
+def tokenize(text: str):
+    """
+    Splits text into lower case words
+    """
+    return token_re.findall(text.casefold()) if text else []
+
+
+def plain_text(markup: str):
+    """
+    Strips tags and entities from HTML so they don't end up in the index
+    """
+    return html.unescape(tag_re.sub(" ", str(markup or "")))
+
+
+class SearchIndex:
+    """
+    Inverted index of words to documents, supporting prefix search with ranking
+
+    :param weights: Relevance of matches in each field, fields not listed have a weight of 1
+    """
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        # word -> {key: weight of the most relevant field containing the word}
+        self.postings = {}
+        # key -> (words, order)
+        self.documents = {}
+        self._words = None
+
+    def add(self, key, order=None, **fields):
+        """
+        Indexes a document, replacing any existing one with the same key
+
+        :param order: Sort key among results with the same relevance, defaults to the key itself
+        :param fields: Text of each field
+        """
+        self.remove(key)
+
+        words = {}
+        for field, text in fields.items():
+            weight = self.weights.get(field, 1)
+            for word in tokenize(text):
+                if weight > words.get(word, 0):
+                    words[word] = weight
+
+        for word, weight in words.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                self._words = None
+            postings[key] = weight
+
+        self.documents[key] = (words, key if order is None else order)
+
+    def remove(self, key):
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+
+        for word in document[0]:
+            postings = self.postings[word]
+            del postings[key]
+            if not postings:
+                del self.postings[word]
+                self._words = None
+
+    def copy(self):
+        """
+        Returns an independent index with the same documents
+        """
+        index = SearchIndex(self.weights)
+        index.postings = {word: dict(postings) for word, postings in self.postings.items()}
+        index.documents = dict(self.documents)
+        index._words = self._words
+        return index
+
+    def clear(self):
+        self.postings = {}
+        self.documents = {}
+        self._words = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def words(self):
+        """
+        Sorted list of the indexed words, used to look up prefixes
+        """
+        if self._words is None:
+            self._words = sorted(self.postings)
+        return self._words
+
+    def match(self, term):
+        """
+        Returns the score of each document containing a word starting with term
+        """
+        scores = {}
+        words = self.words
+        index = bisect.bisect_left(words, term)
+        while index < len(words) and words[index].startswith(term):
+            word = words[index]
+            # Whole words rank higher than prefixes
+            boost = 2 if word == term else 1
+            for key, weight in self.postings[word].items():
+                score = weight * boost
+                if score > scores.get(key, 0):
+                    scores[key] = score
+            index += 1
+        return scores
+
+    def search(self, query: str):
+        """
+        Returns the keys of documents matching every word in the query, most relevant first
+        """
+        scores = None
+        # Longest terms first as they are the most selective
+        for term in sorted(set(tokenize(query)), key=len, reverse=True):
+            matches = self.match(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+
+        return sorted(scores, key=lambda key: (-scores[key], self.documents[key][1]))
@@ -122,6 +122,12 @@ class AppSettings:
 
         return self._global.data.get(key, default)
 
+    def get_own(self, key: str, default=None):
+        """
+        Returns an app-specific setting, without falling back to the global ones
+        """
+        return self._data.get(key, default)
+
 
 class Settings:
     """
@@ -7,14 +7,21 @@ import urllib.parse
 import telethon
 from telethon.sessions import MemorySession
 
+from .. import metrics
 from ..service import ServiceStatus, LogRetainingService
 from ..apps.auth.user import clean_telegram_auth, User
 from ..http.web_app import SocketService, JinjaApp, ServiceWithUserFilter
 from .command import bot_command, BotCommand
 from .events import NewMessageEvent, InlineQueryEvent, ChatActionEvent, CallbackQueryEvent
+from .utils import render_pool, InlineOptions
+from .media_cache import MediaCache
 from . import tl
 
 
+update_time = metrics.histogram("telegram_update_duration_seconds", "Time spent handling Telegram updates", ["bot", "type"])
+update_errors = metrics.counter("telegram_update_errors_total", "Telegram updates that raised an exception", ["bot", "type"])
+
+
 def meta_bot(name, bases, attrs):
     """
     Metaclass for telegram bot to allow automatic registration of commands from methods
@@ -49,6 +56,35 @@ class TelegramBot(LogRetainingService, ServiceWithUserFilter):
         self.flood_end = 0
         self._bot_commands = None
 
+        self.inline_options = InlineOptions.from_settings(self.settings.get("inline"))
+        # In-flight inline queries by user
+        self.inline_tasks = {}
+
+        # Bots can only reuse files they uploaded, so the cache is keyed by bot id
+        self.media_cache = MediaCache.from_settings(self.token.split(":")[0], self.settings.get("media-cache"))
+
+        # The render pool is shared by all bots, so it's only configured by the global settings
+        render_settings = self.settings.data.get("render-pool")
+        if render_settings is not None:
+            render_pool.configure(
+                render_settings.get("workers", 1),
+                render_settings.get("max-pending", 16),
+                render_settings.get("timeout", 30),
+            )
+
+    def on_provider_added(self, provider):
+        super().on_provider_added(provider)
+        if provider.name == "database" and self.media_cache:
+            for model in self.media_cache.database_models():
+                if model not in provider.service.database_models:
+                    provider.service.database_models.append(model)
+
+    def consumes(self):
+        consumes = super().consumes()
+        if self.media_cache and self.media_cache.persist:
+            consumes.append("database")
+        return consumes
+
     @property
     def bot_commands(self):
         if self._bot_commands is None:
@@ -178,29 +214,31 @@ class TelegramBot(LogRetainingService, ServiceWithUserFilter):
         Called on messages sent to the telegram bot
         wraps on_telegram_message() for convenience and detects bot /commands
         """
-        try:
-            self.log.debug("%s NewMessage %s", event.sender_id, event.text[:80])
-            user = self.filter.filter_telegram_id(event.sender_id)
-            event.bot_user = user
-            if not user:
-                self.log.debug("%s is banned", event.sender_id)
-                return
-
-            if not await self.should_process_event(event):
-                return
-
-            match = self.command_trigger.match(event.text)
-            if match:
-                username = match.group("username")
-                if not username or username == self.telegram_me.username:
-                    trigger = match.group("trigger")
-                    args = match.group("args")
-                    if await self.on_telegram_command(trigger, args, event):
-                        return
-
-            await self.on_telegram_message(event)
-        except Exception as e:
-            await self.on_telegram_exception(e)
+        with metrics.timer(update_time, self.name, "message"):
+            try:
+                self.log.debug("%s NewMessage %s", event.sender_id, event.text[:80])
+                user = self.filter.filter_telegram_id(event.sender_id)
+                event.bot_user = user
+                if not user:
+                    self.log.debug("%s is banned", event.sender_id)
+                    return
+
+                if not await self.should_process_event(event):
+                    return
+
+                match = self.command_trigger.match(event.text)
+                if match:
+                    username = match.group("username")
+                    if not username or username == self.telegram_me.username:
+                        trigger = match.group("trigger")
+                        args = match.group("args")
+                        if await self.on_telegram_command(trigger, args, event):
+                            return
+
+                await self.on_telegram_message(event)
+            except Exception as e:
+                update_errors.labels(self.name, "message").inc()
+                await self.on_telegram_exception(e)
 
     async def should_process_event(self, event):
         """
@@ -226,29 +264,61 @@ class TelegramBot(LogRetainingService, ServiceWithUserFilter):
         Called on telegram callback queries (inline button presses),
         just wraps on_telegram_callback() with exception handling for convenience
         """
-        try:
-            event.bot_user = self.filter.filter_telegram_id(event.sender_id)
-            if not event.bot_user:
-                self.log.debug("%s is banned", event.sender_id)
-                return
-            await self.on_telegram_callback(event)
-        except Exception as e:
-            await self.on_telegram_exception(e)
+        with metrics.timer(update_time, self.name, "callback"):
+            try:
+                event.bot_user = self.filter.filter_telegram_id(event.sender_id)
+                if not event.bot_user:
+                    self.log.debug("%s is banned", event.sender_id)
+                    return
+                await self.on_telegram_callback(event)
+            except Exception as e:
+                update_errors.labels(self.name, "callback").inc()
+                await self.on_telegram_exception(e)
 
     async def on_telegram_inline_raw(self, event: InlineQueryEvent):
         """
         Called on telegram inline queries,
         just wraps on_telegram_inline() with exception handling for convenience
         """
-        try:
-            event.bot_user = self.filter.filter_telegram_id(event.sender_id)
-            if not event.bot_user:
-                self.log.debug("%s is banned", event.sender_id)
-                await event.answer([])
-                return
-            await self.on_telegram_inline(event)
-        except Exception as e:
-            await self.on_telegram_exception(e)
+        with metrics.timer(update_time, self.name, "inline"):
+            try:
+                event.bot_user = self.filter.filter_telegram_id(event.sender_id)
+                if not event.bot_user:
+                    self.log.debug("%s is banned", event.sender_id)
+                    await event.answer([])
+                    return
+
+                event.inline_options = self.inline_options
+                event.media_cache = self.media_cache
+                if await self.inline_options.answer_cached(event):
+                    return
+
+                # Telegram sends a query on most keystrokes, only the latest one is relevant.
+                # The handling runs in its own task so cancelling it doesn't affect Telethon's dispatch
+                task = asyncio.create_task(self.on_telegram_inline(event))
+                previous = self.inline_tasks.get(event.sender_id)
+                if previous is not None:
+                    previous.cancel()
+                self.inline_tasks[event.sender_id] = task
+
+                try:
+                    # Unlike awaiting the task, this doesn't cancel it when we're cancelled
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    if self.inline_tasks.get(event.sender_id) is task:
+                        del self.inline_tasks[event.sender_id]
+
+                if task.cancelled():
+                    self.log.debug("%s inline query superseded", event.sender_id)
+                    return
+
+                task.result()
+            except Exception as e:
+                update_errors.labels(self.name, "inline").inc()
+                await self.on_telegram_exception(e)
 
     async def on_telegram_exception(self, exception: Exception):
         """
@@ -1,17 +1,20 @@
 """
 Various bot components and utilities
 """
+import io
 import math
 import random
 import asyncio
 import pathlib
 import dataclasses
+import concurrent.futures.process
 
+from ..cache import LruCache
 from .bot import TelegramBot, ChatActionsBot
 from .command import BotCommand, admin_command
 from .utils import (
     MessageFormatter, static_sticker_file, mentions_from_message, user_name, send_sticker, parse_text,
-    set_admin_title, InlineKeyboard
+    set_admin_title, InlineKeyboard, render_pool, RenderQueueFull
 )
 from .events import NewMessageEvent, CallbackQueryEvent
 from . import tl
@@ -221,33 +224,93 @@ class WelcomeBot(ChatActionsBot):
         super().__init__(settings)
         self.welcome_image = None
         self.welcome_on_join = True
+        # Rendered stickers by display name
+        self.welcome_stickers = LruCache(self.settings.get("welcome-cache-size", 128))
+        self.welcome_renders = {}
 
     async def on_user_join(self, user, chat, event):
         await super().on_user_join(user, chat, event)
         if self.welcome_on_join:
             await self.welcome(user, chat, event)
 
+    async def render_welcome(self, full_name):
+        sticker = await render_pool.run(render_welcome_sticker, self.name, full_name, self.welcome_image, self.emoji_finder)
+        data = sticker.getvalue()
+        self.welcome_stickers.put(full_name, data)
+        return data
+
+    async def welcome_sticker(self, full_name):
+        """
+        Returns the welcome sticker data for the given name
+        """
+        data = self.welcome_stickers.get(full_name)
+        if data is not None:
+            return data
+
+        # Joins with the same name share the render
+        task = self.welcome_renders.get(full_name)
+        if task is None:
+            task = self.welcome_renders[full_name] = asyncio.create_task(self.render_welcome(full_name))
+            task.add_done_callback(lambda task: self.welcome_renders.pop(full_name, None))
+        return await asyncio.shield(task)
+
     async def welcome(self, user, chat, event):
-        import lottie
-        from lottie.utils.font import FontStyle, TextJustify
+        if self.welcome_image is None:
+            self.welcome_image = self._asset_root / self.settings["welcome-image"]
 
         full_name = user_name(user)
+        try:
+            data = await self.welcome_sticker(full_name)
+        except (RenderQueueFull, asyncio.TimeoutError):
+            self.log.warning("Skipped welcome sticker for %s, rendering is overloaded", full_name)
+            return
+        except concurrent.futures.process.BrokenProcessPool:
+            # The render pool starts a new executor for the next job
+            self.log.warning("Skipped welcome sticker for %s, a render worker died", full_name)
+            return
+
+        await send_sticker(event.client, event.chat, io.BytesIO(data), self.media_cache)
 
-        anim = lottie.objects.Animation()
-        fill_color = lottie.utils.color.from_uint8(0x00, 0x33, 0x99)
-        stroke_color = lottie.utils.color.from_uint8(0xff, 0xcc, 0x00)
-        stroke_width = 12
 
-        font = FontStyle("Ubuntu:style=bold", 80, TextJustify.Center, emoji_finder=self.emoji_finder)
+class WelcomeTemplate:
+    """
+    Parts of the welcome sticker that don't depend on the user
+    """
+    fill_color = (0x00, 0x33, 0x99)
+    stroke_color = (0xff, 0xcc, 0x00)
+    stroke_width = 12
+
+    def __init__(self, welcome_image, emoji_finder=None):
+        import lottie
+        from lottie.utils.font import FontStyle, TextJustify
+
+        self.welcome_image = welcome_image
+        self.font = FontStyle("Ubuntu:style=bold", 80, TextJustify.Center, emoji_finder=emoji_finder)
+
+        self.animation = lottie.objects.Animation()
         text_layer = lottie.objects.ShapeLayer()
-        anim.add_layer(text_layer)
-        group = font.render("Welcome", lottie.NVector(256, font.line_height))
+        self.animation.add_layer(text_layer)
+        group = self.font.render("Welcome", lottie.NVector(256, self.font.line_height))
         text_layer.add_shape(group)
-        text_layer.add_shape(lottie.objects.Fill(fill_color))
-        text_layer.add_shape(lottie.objects.Stroke(stroke_color, stroke_width))
+        text_layer.add_shape(lottie.objects.Fill(lottie.utils.color.from_uint8(*self.fill_color)))
+        text_layer.add_shape(lottie.objects.Stroke(lottie.utils.color.from_uint8(*self.stroke_color), self.stroke_width))
+
+        asset = lottie.objects.Image.embedded(welcome_image)
+        self.animation.assets.append(asset)
+        self.animation.add_layer(lottie.objects.ImageLayer(asset.id))
+
+    def render(self, full_name):
+        """
+        Returns the animation for the given name
+        """
+        import lottie
+
+        anim = self.animation.clone()
+        text_layer = anim.layers[0]
+        stroke_color = lottie.utils.color.from_uint8(*self.stroke_color)
 
         pos = lottie.NVector(256, 512)
-        group = font.render(full_name, pos)
+        group = self.font.render(full_name, pos)
         group.transform.anchor_point.value = pos.clone()
         group.transform.position.value = pos.clone()
         bbox = group.bounding_box()
@@ -258,15 +321,24 @@ class WelcomeBot(ChatActionsBot):
         group.transform.position.value.y -= bbox.y2 - 512 + 32
         text_layer.add_shape(group)
         text_layer.add_shape(lottie.objects.Fill(stroke_color))
-        text_layer.add_shape(lottie.objects.Stroke(stroke_color, stroke_width))
+        text_layer.add_shape(lottie.objects.Stroke(stroke_color, self.stroke_width))
+        return anim
 
-        if self.welcome_image is None:
-            self.welcome_image = self._asset_root / self.settings["welcome-image"]
-        asset = lottie.objects.Image.embedded(self.welcome_image)
-        anim.assets.append(asset)
-        anim.add_layer(lottie.objects.ImageLayer(asset.id))
 
-        await send_sticker(event.client, event.chat, static_sticker_file(anim))
+# Welcome templates by bot name, kept in each render process
+welcome_templates = LruCache(16)
+
+
+def render_welcome_sticker(bot_name, full_name, welcome_image, emoji_finder=None):
+    """
+    Renders the welcome sticker, runs in the render pool
+    """
+    template = welcome_templates.get(bot_name)
+    if template is None or template.welcome_image != welcome_image:
+        template = WelcomeTemplate(welcome_image, emoji_finder)
+        welcome_templates.put(bot_name, template)
+
+    return static_sticker_file(template.render(full_name))
 
 
 class LogToChatBot(TelegramBot):
@@ -0,0 +1,130 @@
+import io
+import hashlib
+
+import peewee
+import telethon
+from telethon.errors.rpcerrorlist import FileReferenceExpiredError, FileReferenceInvalidError, FileReferenceEmptyError
+
+from ..cache import LruCache
+from ..db import BaseModel
+from . import tl
+
+
+class CachedMedia(BaseModel):
+    key = peewee.CharField(primary_key=True, max_length=128)
+    document_id = peewee.BigIntegerField()
+    access_hash = peewee.BigIntegerField()
+    file_reference = peewee.BlobField()
+
+
+class MediaCache:
+    """
+    Maps the content hash of uploaded files to their Telegram documents,
+    so identical files are sent by reference instead of being uploaded again
+
+    :param namespace: Prefix for the keys, documents can only be reused by the bot that uploaded them
+    :param max_size: Maximum number of documents to keep in memory
+    :param persist: If True, documents are also stored in the database
+    """
+    reference_errors = (FileReferenceExpiredError, FileReferenceInvalidError, FileReferenceEmptyError)
+
+    def __init__(self, namespace: str, max_size=512, persist=False):
+        self.namespace = namespace
+        self.persist = persist
+        self.documents = LruCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, namespace, settings):
+        """
+        Creates a cache from the `media-cache` setting, returns None if caching is disabled
+        """
+        if settings is False:
+            return None
+
+        if not isinstance(settings, dict):
+            settings = {}
+
+        return cls(namespace, settings.get("max-size", 512), settings.get("persist", False))
+
+    def database_models(self):
+        return [CachedMedia] if self.persist else []
+
+    def key(self, file, kind: str):
+        """
+        Returns the cache key for a file, None if the file can't be cached
+        """
+        if isinstance(file, io.BytesIO):
+            data = file.getvalue()
+        elif isinstance(file, bytes):
+            data = file
+        else:
+            return None
+
+        return "%s:%s:%s" % (self.namespace, kind, hashlib.blake2b(data, digest_size=16).hexdigest())
+
+    def get(self, key):
+        """
+        Returns the InputDocument for key or None
+        """
+        if key is None:
+            return None
+
+        document = self.documents.get(key)
+        if document is None and self.persist:
+            stored = CachedMedia.get_or_none(CachedMedia.key == key)
+            if stored:
+                document = tl.types.InputDocument(stored.document_id, stored.access_hash, bytes(stored.file_reference))
+                self.documents.put(key, document)
+
+        if document is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return document
+
+    def put(self, key, document):
+        document = telethon.utils.get_input_document(document)
+        self.documents.put(key, document)
+        if self.persist:
+            CachedMedia.replace(
+                key=key,
+                document_id=document.id,
+                access_hash=document.access_hash,
+                file_reference=document.file_reference
+            ).execute()
+
+    def invalidate(self, key):
+        self.documents.pop(key)
+        if self.persist:
+            CachedMedia.delete().where(CachedMedia.key == key).execute()
+
+    async def send(self, kind: str, file, send, get_document=None):
+        """
+        Sends a file by reference if it has been uploaded before
+
+        :param kind: Distinguishes the same data sent in different ways
+        :param send: Coroutine function called with either the file or its document
+        :param get_document: Callable returning the uploaded document from the result of send,
+            defaults to reading the media of the sent message
+        """
+        key = self.key(file, kind)
+        document = self.get(key)
+        if document is not None:
+            try:
+                return await send(document)
+            except self.reference_errors:
+                self.invalidate(key)
+
+        result = await send(file)
+
+        if key is not None:
+            if get_document:
+                uploaded = get_document(result)
+            else:
+                uploaded = getattr(getattr(result, "media", None), "document", None)
+            if uploaded is not None:
+                self.put(key, uploaded)
+
+        return result
@@ -1,12 +1,17 @@
 import io
 import asyncio
+import inspect
+import multiprocessing
+import concurrent.futures
 
 from PIL import Image
 
 from telethon.helpers import add_surrogate
 
+from ..cache import LruCache
 from . import tl
 from .events import InlineQueryEvent, NewMessageEvent
+from .media_cache import MediaCache
 
 
 def animated_sticker_file(animation):
@@ -41,39 +46,233 @@ def photo_file(image, format, background=(0, 0, 0, 0)):
     return out_image
 
 
-async def send_animated_sticker(client, chat, file, *a, **kw):
-    return await client.send_file(chat, file, attributes=[
-        tl.types.DocumentAttributeFilename("sticker.tgs")
-    ], *a, **kw)
+def mp_context():
+    """
+    Multiprocessing context for the render workers
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class RenderQueueFull(Exception):
+    """
+    Raised when too many render jobs are pending
+    """
+    pass
 
 
-async def send_sticker(client, chat, file):
+class RenderPool:
+    """
+    Runs image and sticker rendering in worker processes
+
+    Workers are started with forkserver (or spawn where that's not available),
+    forking the server process would copy the event loop and open connections
+
+    :param workers: Number of worker processes, 0 to render on the event loop
+    :param max_pending: Maximum number of jobs queued or running
+    :param timeout: Seconds to wait for a job before giving up on it
+    """
+    def __init__(self, workers=1, max_pending=16, timeout=30):
+        self.executor = None
+        self.pending = 0
+        self.configure(workers, max_pending, timeout)
+
+    def configure(self, workers=1, max_pending=16, timeout=30):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=mp_context())
+        return self.executor
+
+    def reset(self, executor):
+        """
+        Drops a broken executor, a new one is created for the next job
+        """
+        if self.executor is executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def job_done(self, future):
+        self.pending -= 1
+
+    async def run(self, func, *args):
+        """
+        Runs func(*args) in a worker process
+
+        func and its arguments must be picklable, so func has to be a module-level function
+        """
+        if self.workers == 0:
+            return func(*args)
+
+        if self.pending >= self.max_pending:
+            raise RenderQueueFull()
+
+        executor = self.get_executor()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died, start over with a new pool
+            self.reset(executor)
+            executor = self.get_executor()
+            future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+        # Timed out jobs keep a worker busy until they finish, so they still count as pending
+        self.pending += 1
+        future.add_done_callback(self.job_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died during the job, the pool can't be used any more
+            self.reset(executor)
+            raise
+
+
+render_pool = RenderPool()
+
+
+async def send_animated_sticker(client, chat, file, *a, media_cache: MediaCache = None, **kw):
+    async def send(file):
+        return await client.send_file(chat, file, attributes=[
+            tl.types.DocumentAttributeFilename("sticker.tgs")
+        ], *a, **kw)
+
+    if media_cache is None:
+        return await send(file)
+    return await media_cache.send("sticker.tgs", file, send)
+
+
+async def send_sticker(client, chat, file, media_cache: MediaCache = None):
     file.name = "sticker.webp"
-    return await client.send_file(chat, file, force_document=False, attributes=[
-        tl.types.DocumentAttributeFilename("sticker.webp")
-    ])
+
+    async def send(file):
+        return await client.send_file(chat, file, force_document=False, attributes=[
+            tl.types.DocumentAttributeFilename("sticker.webp")
+        ])
+
+    if media_cache is None:
+        return await send(file)
+    return await media_cache.send("sticker.webp", file, send)
+
+
+class CachedInlineAnswer:
+    def __init__(self, results, next_offset, gallery, switch_webview):
+        self.results = results
+        self.next_offset = next_offset
+        self.gallery = gallery
+        self.switch_webview = switch_webview
+
+
+class InlineOptions:
+    """
+    Per-bot inline query settings, from the `inline` setting
+
+    :param cache_time: Seconds Telegram caches results for
+    :param is_personal: Whether results depend on the user, both for Telegram's and the server cache
+    :param server_cache: Seconds answers are cached on the server, 0 to disable
+    :param server_cache_size: Maximum number of cached answers
+    """
+    def __init__(self, cache_time=0, is_personal=False, server_cache=0, server_cache_size=256):
+        self.cache_time = cache_time
+        self.is_personal = is_personal
+        self.cache = LruCache(server_cache_size, server_cache) if server_cache else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        settings = settings or {}
+        return cls(
+            settings.get("cache-time", 0),
+            settings.get("personal", False),
+            settings.get("server-cache", 0),
+            settings.get("server-cache-size", 256),
+        )
+
+    def cache_key(self, event: InlineQueryEvent):
+        text = " ".join(event.query.query.lower().split())
+        key = (text, event.query.offset)
+        if self.is_personal:
+            key += (event.sender_id,)
+        return key
+
+    def store(self, event: InlineQueryEvent, answer: CachedInlineAnswer):
+        if self.cache is not None:
+            self.cache.put(self.cache_key(event), answer)
+
+    def discard(self, event: InlineQueryEvent):
+        if self.cache is not None:
+            self.cache.pop(self.cache_key(event))
+
+    def clear(self):
+        """
+        Drops the cached answers, call this when the data shown in the results changes
+        """
+        if self.cache is not None:
+            self.cache.clear()
+
+    async def answer_cached(self, event: InlineQueryEvent):
+        """
+        Answers the query from the cache
+
+        :return: False if the answer isn't cached
+        """
+        if self.cache is None:
+            return False
+
+        answer = self.cache.get(self.cache_key(event))
+        if answer is None:
+            return False
+
+        handler = InlineHandler(event)
+        handler.next_offset = answer.next_offset
+        handler.gallery = answer.gallery
+        handler.switch_webview = answer.switch_webview
+        await handler.send(answer.results)
+        return True
 
 
 class InlineHandler:
     """
     Context manager that provides a simple interface to provide inline results
     It also includes sticker support
+
+    :param media_cache: If not None, stickers are only uploaded the first time they are used,
+        defaults to the cache of the bot that received the query
     """
-    def __init__(self, event: InlineQueryEvent):
+    def __init__(self, event: InlineQueryEvent, media_cache: MediaCache = None):
         self.event = event
+        self.media_cache = media_cache if media_cache is not None else getattr(event, "media_cache", None)
+        self.media_keys = []
         self.builder = event.builder
         self.query = event.query.query
         self.results = []
+        # Set by TelegramBot from its settings
+        self.options = getattr(event, "inline_options", None) or InlineOptions()
         #For how long this result should be cached on the user's client. Defaults to 0 for no cache.
-        self.cache_time = 0
+        self.cache_time = self.options.cache_time
+        # Whether the results are specific to the user
+        self.is_personal = self.options.is_personal
         # Whether the results should show as a gallery (grid) or not.
         self.gallery = False
         self.switch_webview = None
+        # Offset Telegram sends back when the user scrolls past the results, None for the last page
+        self.next_offset = None
 
     async def __aenter__(self):
         return self
 
-    async def __aexit__(self, *a, **kw):
+    async def __aexit__(self, exc_type, exc, traceback):
+        # Superseded by a newer query
+        if exc_type is asyncio.CancelledError:
+            for result in self.results:
+                if inspect.iscoroutine(result):
+                    result.close()
+            return
         await self.answer()
 
     async def answer(self):
@@ -81,18 +280,74 @@ class InlineHandler:
             results = await asyncio.gather(*self.results)
         else:
             results = []
-        await self.event.client(
-            tl.functions.messages.SetInlineBotResultsRequest(
-                query_id=self.event.query.query_id,
-                results=results,
-                cache_time=self.cache_time,
-                gallery=self.gallery,
-                next_offset=None,
-                private=False,
-                switch_pm=None,
-                switch_webview=self.switch_webview
+        self.options.store(self.event, CachedInlineAnswer(results, self.next_offset, self.gallery, self.switch_webview))
+        await self.send(results)
+
+    async def send(self, results):
+        try:
+            await self.event.client(
+                tl.functions.messages.SetInlineBotResultsRequest(
+                    query_id=self.event.query.query_id,
+                    results=results,
+                    cache_time=self.cache_time,
+                    gallery=self.gallery,
+                    next_offset=self.next_offset,
+                    private=self.is_personal,
+                    switch_pm=None,
+                    switch_webview=self.switch_webview
+                )
             )
-        )
+        except MediaCache.reference_errors:
+            # Drop the stale documents so the next query uploads them again
+            for key in self.media_keys:
+                self.media_cache.invalidate(key)
+            self.options.discard(self.event)
+            raise
+
+    async def cached_document(self, kind, file, **kwargs):
+        async def build(file):
+            return await self.builder.document(file, "", **kwargs)
+
+        if self.media_cache is None:
+            return await build(file)
+
+        key = self.media_cache.key(file, kind)
+        if key is not None:
+            self.media_keys.append(key)
+        return await self.media_cache.send(kind, file, build, lambda result: result.document)
+
+    @property
+    def offset(self):
+        """
+        Index of the first result requested by Telegram
+        """
+        try:
+            return max(0, int(self.event.query.offset or 0))
+        except ValueError:
+            return 0
+
+    def paginate(self, items, page_size=50):
+        """
+        Returns the items for the requested page and sets next_offset
+        """
+        start = self.offset
+        end = start + page_size
+        if end < len(items):
+            self.next_offset = str(end)
+        return items[start:end]
+
+    def add_result(self, result):
+        """
+        Adds a result, either already built (eg: cached from builder.article()) or awaitable
+        """
+        if not inspect.isawaitable(result):
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(result)
+            result = future
+        self.results.append(result)
+
+    def article(self, *a, **kw):
+        self.results.append(self.builder.article(*a, **kw))
 
     def document(self, *a, **kw):
         self.results.append(self.builder.document(*a, **kw))
@@ -105,8 +360,8 @@ class InlineHandler:
 
     def sticker(self, file):
         file.name = "sticker.webp"
-        self.results.append(self.builder.document(
-            file, "",
+        self.results.append(self.cached_document(
+            "sticker.webp", file,
             mime_type="image/webp",
             type="sticker",
             attributes=[
@@ -115,8 +370,8 @@ class InlineHandler:
         ))
 
     def animated_sticker(self, file):
-        self.results.append(self.builder.document(
-            file, "",
+        self.results.append(self.cached_document(
+            "sticker.tgs", file,
             mime_type="application/x-tgsticker",
             type="sticker",
             attributes=[
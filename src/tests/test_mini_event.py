@@ -0,0 +1,72 @@
+import types
+import base64
+import logging
+import pathlib
+import tempfile
+import unittest
+
+import peewee
+
+from mini_apps.apps.mini_event.mini_event import MiniEventApp, Event, UserEvent
+from mini_apps.search import SearchIndex
+from mini_apps.telegram.utils import InlineOptions
+
+
+class FakeClient:
+    def __init__(self):
+        self.user = types.SimpleNamespace(is_admin=True)
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+class TestMiniEventApp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.database = peewee.SqliteDatabase(":memory:")
+        self.database.bind([Event, UserEvent])
+        self.database.create_tables([Event, UserEvent])
+
+        self.media = tempfile.TemporaryDirectory()
+        (pathlib.Path(self.media.name) / "media").mkdir()
+
+        # Skips the constructor as it needs a full server
+        self.app = MiniEventApp.__new__(MiniEventApp)
+        self.app.name = "mini_event"
+        self.app.log = logging.getLogger("mini_event")
+        self.app.settings = types.SimpleNamespace(paths=types.SimpleNamespace(client=pathlib.Path(self.media.name)))
+        self.app.events = {}
+        self.app.sorted_events = []
+        self.app.inline_articles = {}
+        self.app.inline_options = InlineOptions()
+        self.app.search_index = SearchIndex({"title": 3})
+        self.app.clients = {}
+        self.client = FakeClient()
+
+    def tearDown(self):
+        self.database.close()
+        self.media.cleanup()
+
+    async def create_event(self, title):
+        await self.app._on_create_event(self.client, {
+            "title": title,
+            "description": "Description of %s" % title,
+            "duration": "1",
+            "start": "2024-01-01 10:00",
+            "image": {"name": "image.png", "base64": base64.b64encode(b"image").decode("ascii")},
+        })
+        return self.app.sorted_events[-1]
+
+    async def test_delete_then_create_drops_inline_article(self):
+        deleted = await self.create_event("Deleted")
+        self.app.inline_articles[deleted.id] = "article for Deleted"
+
+        await self.app._on_delete_event(self.client, {"id": deleted.id})
+        self.assertNotIn(deleted.id, self.app.inline_articles)
+
+        # SQLite reuses the rowid of the deleted event
+        self.app.inline_articles[deleted.id] = "stale article"
+        created = await self.create_event("Created")
+        self.assertEqual(created.id, deleted.id)
+        self.assertNotIn(created.id, self.app.inline_articles)
+        self.assertEqual(self.app.search_index.search("created"), [created.id])
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+from mini_apps.polling import PollingService
+
+
+class TestPollingService(unittest.IsolatedAsyncioTestCase):
+    def service(self, callback, **kwargs):
+        return PollingService({"name": "test-poll"}, callback, 0.01, jitter=0, **kwargs)
+
+    async def test_run_keeps_polling_after_delay_timeout(self):
+        polls = 0
+
+        async def callback():
+            nonlocal polls
+            polls += 1
+
+        service = self.service(callback)
+        task = asyncio.create_task(service.run())
+        # The wait between runs ends with wait_for() timing out
+        await asyncio.sleep(0.1)
+        self.assertFalse(task.done())
+        await service.stop()
+        await task
+
+        self.assertGreater(polls, 2)
+
+    async def test_poll_timeout(self):
+        async def callback():
+            await asyncio.sleep(1)
+
+        service = self.service(callback, timeout=0.01)
+        with self.assertLogs(service.log, "WARNING") as logs:
+            self.assertFalse(await service.poll())
+        self.assertIn("timed out", logs.output[0])
+        self.assertEqual(service.failures, 1)
+
+    async def test_trigger_coalesces(self):
+        polls = 0
+
+        async def callback():
+            nonlocal polls
+            polls += 1
+            await asyncio.sleep(0.01)
+
+        service = self.service(callback)
+        await asyncio.gather(service.trigger(), service.trigger())
+        self.assertEqual(polls, 1)
@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import peewee
+
+from mini_apps.apps.auth.user import User
+from mini_apps.apps.tic_tac_toe.tic_tac_toe import DatabaseGameStore, StoredGame, Game, Player
+
+
+class TestDatabaseGameStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.database = peewee.SqliteDatabase(":memory:")
+        self.database.bind([StoredGame])
+        self.database.create_tables([StoredGame])
+        self.errors = 0
+        self.store = DatabaseGameStore(0.01, self.on_error)
+        self.game = Game(Player(User(1, "Host")))
+
+    def tearDown(self):
+        self.database.close()
+
+    def on_error(self):
+        self.errors += 1
+
+    async def test_retry_after_failed_write(self):
+        task = asyncio.create_task(self.store.run())
+        with mock.patch.object(StoredGame, "replace", side_effect=peewee.OperationalError("locked")):
+            self.store.save(self.game)
+            await asyncio.sleep(0.05)
+        self.assertEqual(self.errors, 1)
+        self.assertEqual(StoredGame.select().count(), 0)
+
+        # No other save comes, the periodic retry writes the game
+        self.store.retry()
+        await asyncio.sleep(0.05)
+        self.assertEqual(StoredGame.select().count(), 1)
+        self.assertEqual(self.store.pending, {})
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def test_flush_on_shutdown(self):
+        task = asyncio.create_task(self.store.run())
+        await asyncio.sleep(0)
+        self.store.save(self.game)
+        with mock.patch.object(self.store, "flush", wraps=self.store.flush) as flush:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        flush.assert_called_once()
+        self.assertEqual(StoredGame.select().count(), 1)